@@ -1,12 +1,28 @@
-import time
-from itertools import chain
+import time, os
+from collections import deque
+from datetime import datetime
+from enum import Enum
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from adafruit_ht16k33.segments import Seg7x4
 
+from histogram import LogHistogram
+from scheduler import Lateness
+
 # for main()
 from argparse import ArgumentParser, BooleanOptionalAction
 import board, signal
 
 
+class ClockMode(Enum):
+    r"""What the last pair of digits counts, and so how often it changes.
+
+    The value is the number of frames per second.
+    """
+    THIRDS = 60        # HH:MM.SS.TT
+    HUNDREDTHS = 100   # HH:MM.SS.hh
+    FOURTHS = 3600     # MM:SS.TT.FF (no room left for the hours)
+
+
 class Config:
     #   -- 1 --            -- A --
     #  |       |          |       |
@@ -28,6 +44,9 @@ class Config:
     DOT    = 0b10000000
     NO_DOT = 0b00000000
 
+    # the colon has its own byte of display RAM, at address 4
+    COLON  = 0b00000010
+
     BITS = [
         (A | B | C | D | E | F),          # 0
         (B | C),                          # 1
@@ -48,6 +67,9 @@ class Config:
         NO_DOT, NO_DOT,  # 19
     )
 
+    # digit, 0, digit, 0, colon, 0, digit, 0, digit
+    RAM_SIZE = 9
+
     BRIGHTNESS_MULTIPLIER = 0.0625   # 1/16
     BRIGHTNESS = 8           # 8/16
 
@@ -55,12 +77,297 @@ class Config:
 
     LOCAL_TIME = True
 
+    # None for whatever the system's using
+    ZONE = None
+
+    MODE = ClockMode.THIRDS
+
+    # how many frames to render before they're needed
+    LOOK_AHEAD = 30
+
+    # the most of each frame's time the clock ought to use; beyond that,
+    #  it skips frames
+    FRAME_BUDGET = 0.5
+
+    # A frame is on the display only once its write is done, so the clock
+    #  starts each write early by (a smoothed estimate of) how long
+    #  writing takes. This is how much weight each new measurement gets.
+    LEAD_SMOOTHING = 1/16
+    # the most of a frame the lead can be (or a tick would be starting on
+    #  a frame before the one before it was even on the display)
+    LEAD_MAX = 0.5
+    # a tick that comes at most this much of a frame earlier than even
+    #  the lead would have it is still for the frame that's about to start
+    SNAP = 0.25
+
+
+class Frames:
+    r"""Precomputed seven-segment display RAM.
+
+    Every pair of digits on the clock (hours, minutes, seconds, thirds)
+    shows a value from 0 to 59 (or to 99, for hundredths), and its
+    separator dot is either lit or not. That's few enough combinations
+    that we can just build them all up front, so that a tick is a
+    handful of lookups and a comparison.
+
+    The tables are laid out the way the HT16K33 wants them: each digit
+    takes two bytes of display RAM (only the first of which we use), and
+    the colon lives in between the second and third digits. So each
+    chip's RAM, from address 0, is::
+
+        digit, 0, digit, 0, colon, 0, digit, 0, digit
+
+    ``frames[separators]`` is a tuple of four tables, one per pair, each
+    mapping a value to the three bytes for that pair's digits.
+    ``frames.middles[separators]`` is the three bytes that go between the
+    pairs on each chip (i.e., the colon, on the left-hand chip).
+    """
+    VALUES = 100
+
+    def __init__(self, bits=Config.BITS, dot_pattern=Config.CLOCK_DOT_PATTERN):
+        self.tables = tuple(
+            tuple(
+                tuple(
+                    bytes((
+                        bits[tens] | (tens_dot * separators),
+                        Config.NO_DOT,
+                        bits[ones] | (ones_dot * separators),
+                    ))
+                    for tens, ones in (divmod(v, 10) for v in range(self.VALUES))
+                )
+                for tens_dot, ones_dot in zip(dot_pattern[0::2], dot_pattern[1::2])
+            )
+            for separators in (False, True)
+        )
+        self.middles = tuple(
+            (
+                bytes((0, Config.COLON * separators, 0)),
+                bytes((0, 0, 0)),
+            )
+            for separators in (False, True)
+        )
+
+    def __getitem__(self, separators):
+        return self.tables[separators]
+
+
+class DisplayRAM:
+    r"""What we believe to be in one HT16K33's display RAM.
+
+    Rather than pushing all of RAM on every change (which is what
+    ``Seg7x4.show()`` does, for every chip), send only the range of bytes
+    that actually differ, and only to the chip they differ on.
+
+    :param arbiter: an I2CArbiter to write through, if the bus has one
+    """
+    def __init__(self, i2c_device, size=Config.RAM_SIZE, arbiter=None):
+        self.i2c_device = i2c_device
+        self.arbiter = arbiter
+        self.ram = bytes(size)
+
+    def update(self, ram):
+        old = self.ram
+        if ram == old:
+            return 0
+        start = 0
+        while old[start] == ram[start]:
+            start += 1
+        end = len(ram)
+        while old[end-1] == ram[end-1]:
+            end -= 1
+
+        # the first byte is the RAM address to start writing at
+        data = bytes((start,)) + ram[start:end]
+        if self.arbiter is not None:
+            self.arbiter.write_now(self.i2c_device.device_address, data)
+        else:
+            with self.i2c_device:
+                self.i2c_device.write(data)
+        self.ram = ram
+        return len(data)
+
+
+class Calendar:
+    r"""Hours, minutes and seconds, without asking libc every time.
+
+    A tick only needs the broken-down time when the second rolls over,
+    and even then, for UTC it's just arithmetic. Local time is the same
+    arithmetic plus an offset, which changes only a couple of times a
+    year, so we look up when the current offset stops being valid (via
+    ``zoneinfo``, or failing that, ``time.localtime()``) ahead of time,
+    and only look again once it has.
+    """
+    DAY = 24 * 60 * 60
+    # how far to look for the next change in offset
+    HORIZON = 400 * DAY
+
+    def __init__(self, zone=Config.ZONE):
+        self.zone = _local_zone() if zone is None else ZoneInfo(zone)
+
+        # the local offset, and the span over which it's good
+        self.offset = 0
+        self.since = 0
+        self.until = 0
+
+        # the last second we worked out, and what we worked out
+        self.last = None
+        self.hms = None
+
+    def _utcoffset(self, t):
+        if self.zone is None:
+            return time.localtime(t).tm_gmtoff
+        return int(datetime.fromtimestamp(t, self.zone).utcoffset().total_seconds())
+
+    def _find_offset(self, t):
+        offset = self._utcoffset(t)
+
+        # step forward a day at a time until the offset changes...
+        before = t
+        after = t + self.DAY
+        while after < t + self.HORIZON and self._utcoffset(after) == offset:
+            before, after = after, after + self.DAY
+        # ...then narrow it down to the second
+        if self._utcoffset(after) != offset:
+            while after - before > 1:
+                middle = (before + after) // 2
+                if self._utcoffset(middle) == offset:
+                    before = middle
+                else:
+                    after = middle
+
+        self.offset = offset
+        self.since = t
+        self.until = after
+
+    def __call__(self, t, local):
+        r"""Given a time, return the hours, minutes and seconds.
+
+        :param t: a time, in whole seconds since the epoch
+        :param local: True for local time, False for UTC
+        :return: (hours, minutes, seconds)
+        """
+        if (t, local) == self.last:
+            return self.hms
+
+        if local:
+            if not self.since <= t < self.until:
+                self._find_offset(t)
+            seconds = (t + self.offset) % self.DAY
+        else:
+            seconds = t % self.DAY
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+
+        self.last = (t, local)
+        self.hms = (hours, minutes, seconds)
+        return self.hms
+
+
+class Pacing:
+    r"""How many frames the clock can actually manage to show.
+
+    Keeps a smoothed measure of how long each frame takes to get out
+    (rendering plus I2C), and from that picks a stride: show every frame,
+    or every second one, or every third, and so on. Strides always divide
+    the frame rate evenly, so the frames that *are* shown are evenly
+    spaced and line up with the second, rather than drifting.
+
+    :param rate: frames per second
+    :param budget: the most of each frame's time we're willing to use
+    """
+    def __init__(self, rate, budget=Config.FRAME_BUDGET, adapt=1/16):
+        self.rate = rate
+        self.budget = budget
+        self.adapt = adapt
+        self.strides = [d for d in range(1, rate + 1) if rate % d == 0]
+        self.stride = 1
+
+        # smoothed nanoseconds per frame, and I2C bytes per second
+        self.cost = 0.0
+        self.throughput = 0.0
+
+        self.last = None
+        self.frames = 0     # frames that have gone by
+        self.shown = 0      # frames we've shown
+        self.missed = 0     # frames dropped beyond what the stride meant to
+
+    def _allowance(self, stride):
+        return self.budget * stride * 1e9 / self.rate
+
+    def measure(self, cost, nbytes=0, bus_time=0):
+        r"""Account for the work done for one frame.
+
+        :param cost: nanoseconds spent on the frame, all told
+        :param nbytes: bytes written to the bus
+        :param bus_time: nanoseconds spent writing them
+        """
+        self.cost += self.adapt * (cost - self.cost)
+        if bus_time:
+            self.throughput += self.adapt * (nbytes * 1e9 / bus_time - self.throughput)
+
+        stride = self.stride
+        if self.cost > self._allowance(stride):
+            # can't keep up; back off to the next stride that we can
+            for stride in self.strides:
+                if stride > self.stride and self.cost <= self._allowance(stride):
+                    break
+        else:
+            # can we do better? (with some slack, so we don't dither)
+            for smaller in self.strides:
+                if smaller >= stride:
+                    break
+                if self.cost <= 0.75 * self._allowance(smaller):
+                    stride = smaller
+                    break
+        self.stride = stride
+
+    def show(self, frame):
+        if self.last is not None and frame > self.last:
+            elapsed = frame - self.last
+            self.frames += elapsed
+            self.shown += 1
+            self.missed += max(elapsed // self.stride - 1, 0)
+        self.last = frame
+
+    @property
+    def dropped(self):
+        return max(self.frames - self.shown, 0)
+
+    def __str__(self):
+        percent = 100 * self.dropped / self.frames if self.frames else 0
+        return (
+            f"{self.rate // self.stride}/s of {self.rate}/s,"
+            f" dropped {self.dropped} of {self.frames} ({percent:.1f}%),"
+            f" {self.missed} unplanned;"
+            f" {self.cost/1e3:.0f}\xB5s/frame, I2C {self.throughput:.0f} bytes/s"
+        )
+
+
+def _local_zone():
+    r"""The local time zone, or None if zoneinfo can't make sense of it.
+
+    (As for a POSIX TZ rule like "EST5EDT,M3.2.0,M11.1.0", or a system
+    with no /etc/localtime; time.localtime() still knows what to do.)
+    """
+    tz = os.environ.get('TZ')
+    try:
+        if tz:
+            return ZoneInfo(tz.lstrip(':'))
+        with open('/etc/localtime', 'rb') as localtime:
+            return ZoneInfo.from_file(localtime, key='localtime')
+    except (OSError, ValueError, ZoneInfoNotFoundError) as e:
+        print(f"local time zone not in zoneinfo ({e!r}); using time.localtime()")
+        return None
+
 
 class Clock:
     def __init__(self, i2c, *addrs,
             brightness=Config.BRIGHTNESS,
             blink=Config.BLINK_SEPARATORS,
-            local=Config.LOCAL_TIME
+            local=Config.LOCAL_TIME,
+            look_ahead=Config.LOOK_AHEAD,
+            mode=Config.MODE,
+            arbiter=None,
         ):
 
         self.blink = blink
@@ -70,53 +377,159 @@ class Clock:
         self.seg7x4 = Seg7x4(i2c, addrs, auto_write=False)
         self.seg7x4.brightness = brightness * Config.BRIGHTNESS_MULTIPLIER
 
-        self.curr_seg7s = [Config.NO_DOT] * (len(addrs) * 4)
-        self.curr_colon = False
+        self.frames = Frames()
+        self.calendar = Calendar()
+        self.left, self.right = (
+            DisplayRAM(device, arbiter=arbiter)
+            for device in self.seg7x4.i2c_device
+        )
+
+        # frames rendered ahead of time, as (frame number, left, right),
+        #  where a frame number is the count of frames since the epoch
+        self.look_ahead = look_ahead
+        self.ahead = deque(maxlen=look_ahead)
+
+        # nanoseconds from the start of each frame until it's on the display
+        self.latency = LogHistogram()
+        # seconds to start a tick before the frame it's for
+        self.lead = 0.0
+        # seconds from the start of each frame until it's on the display,
+        #  early or late (which is to say, what the lead didn't fix)
+        self.residual = Lateness()
+
+        self.set_mode(mode)
+        self.clear()
+
+    @property
+    def interval(self):
+        r"""Seconds between the frames we're actually going to show."""
+        return self.pacing.stride / self.rate
+
+    def set_mode(self, mode):
+        self.mode = mode
+        self.rate = mode.value
+        self.pacing = Pacing(self.rate)
+        self.ahead.clear()
+        self.lead = min(self.lead, Config.LEAD_MAX * self.interval)
+        self._started = None
+        self._bytes = 0
+        self._bus_time = 0
+
+    def set_brightness(self, brightness):
+        self.brightness = min(max(brightness, 0), 16)
+        self.seg7x4.brightness = self.brightness * Config.BRIGHTNESS_MULTIPLIER
 
     def increase_brightness(self):
-        pass
+        self.set_brightness(self.brightness + 1)
 
     def decrease_brightness(self):
-        pass
+        self.set_brightness(self.brightness - 1)
 
     def toggle_local(self):
         self.local = not self.local
+        self.ahead.clear()
+
+    def toggle_blink(self):
+        self.blink = not self.blink
+        self.ahead.clear()
+
+    def stepped(self):
+        r"""The wall clock jumped; forget anything worked out from it."""
+        self.ahead.clear()
+        self.pacing.last = None
+
+    def render(self, frame):
+        r"""Render the display RAM for both chips for the given frame.
+
+        :param frame: number of frames since the epoch
+        :return: (left, right) display RAM
+        """
+        t, fraction = divmod(frame, self.rate)
+        hours, minutes, seconds = self.calendar(t, self.local)
+        separators = not self.blink or fraction < self.rate // 2
+
+        if self.mode is ClockMode.FOURTHS:
+            hours, minutes, (seconds, fraction) = minutes, seconds, divmod(fraction, 60)
+
+        hh, mm, ss, ff = self.frames[separators]
+        colon, blank = self.frames.middles[separators]
+        return (
+            hh[hours] + colon + mm[minutes],
+            ss[seconds] + blank + ff[fraction],
+        )
+
+    def render_ahead(self):
+        r"""Fill the look-ahead buffer with the frames coming up next.
+
+        This is the part of a tick that takes actual work, so it should
+        be called right *after* a tick, when the next deadline is as far
+        off as it's going to get.
+        """
+        stride = self.pacing.stride
+        now = time.time_ns() * self.rate // 1_000_000_000
+        now -= now % stride
+        ahead = self.ahead
+        frame = ahead[-1][0] + stride if ahead and ahead[-1][0] >= now else now
+        frame -= frame % stride
+        while frame < now + self.look_ahead * stride:
+            ahead.append((frame, *self.render(frame)))
+            frame += stride
+
+        if self._started is not None:
+            self.pacing.measure(
+                time.perf_counter_ns() - self._started,
+                self._bytes, self._bus_time
+            )
+            self._started = None
+
+    def _frame(self, ns):
+        r"""The frame a tick at ns past the epoch is for.
+
+        Ticks start early by the lead, so it's the one that'll have started
+        by the time the lead is up; or, if it's within Config.SNAP of a
+        frame of the next one even then, that next one.
+        """
+        stride = self.pacing.stride
+        ns += int(self.lead * 1_000_000_000)
+        snap = int(Config.SNAP * 1_000_000_000)
+        return (ns * self.rate + snap) // (stride * 1_000_000_000) * stride
 
     def tick(self):
-        t = time.time()
-        _, _, _, hours, minutes, seconds, _, _, _ = \
-            time.localtime(t) if self.local else time.gmtime(t)
-        thirds = int((t%1)*60)
-        separators = not self.blink or thirds < 30
-
-        # This is undoubtedly too cute by half.
-        # But it is very cute.
-        seg7s = list(map(lambda bits: bits[0] | bits[1], zip(
-            [Config.BITS[digit] for digit in chain.from_iterable(
-                divmod(part, 10) for part in (hours, minutes, seconds, thirds)
-            )],
-            map(lambda bits: bits[0] * bits[1], zip(
-                Config.CLOCK_DOT_PATTERN, [separators]*8
-            ))
-        )))
-
-        show = False
-        for i, (old, new) in enumerate(zip(self.curr_seg7s, seg7s)):
-            if old == new:
-                continue
-            self.seg7x4.set_digit_raw(i, new)
-            show = True
-        if self.curr_colon is not separators:
-            self.curr_colon = separators
-            self.seg7x4.colon = separators
-            show = True
-
-        if show:
-            self.seg7x4.show()
+        started = time.perf_counter_ns()
+        now = self._frame(time.time_ns())
+
+        # throw away anything that's already past
+        ahead = self.ahead
+        while ahead and ahead[0][0] < now:
+            ahead.popleft()
+
+        if ahead and ahead[0][0] == now:
+            _, left, right = ahead[0]
+        else:
+            # nothing rendered in time, so we'll have to do it ourselves
+            left, right = self.render(now)
+
+        writing = time.perf_counter_ns()
+        # (don't short-circuit this: both chips need updating)
+        written = self.left.update(left) + self.right.update(right)
+        if written:
+            late = time.time_ns() - now * 1_000_000_000 // self.rate
+            # (the histogram can't do early, so that's only in residual)
+            self.latency.record(max(late, 0))
+            self.residual.record(late / 1e9)
+            took = (time.perf_counter_ns() - started) / 1e9
+            self.lead += (took - self.lead) * Config.LEAD_SMOOTHING
+            self.lead = min(self.lead, Config.LEAD_MAX * self.interval)
+            self.pacing.show(now)
+            self._started = started
+            self._bytes = written
+            self._bus_time = time.perf_counter_ns() - writing
 
     def clear(self):
         self.seg7x4.fill(0)
         self.seg7x4.show()
+        for ram in (self.left, self.right):
+            ram.ram = bytes(len(ram.ram))
 
 
 def main():
@@ -151,6 +564,10 @@ def main():
         action=BooleanOptionalAction,
         help="show UTC rather than local time"
     )
+    argyle.add_argument('-m', '--mode',
+        choices=[m.name.lower() for m in ClockMode], default='thirds',
+        help="what the last two digits count"
+    )
     argyle.add_argument('time',
         type=float, nargs='?', default=time.time(),
         help="time to display"
@@ -166,18 +583,19 @@ def main():
         *(args.address),
         brightness=args.brightness,
         blink=args.blink_separators,
-        local=not(args.universal_time)
+        local=not(args.universal_time),
+        mode=ClockMode[args.mode.upper()],
     )
 
-    def sleep_until_interval(interval):
+    def sleep_until_interval(interval, lead=0):
         r"""Given an interval, sleep until the beginning of the next whole
         interval.
 
         :param interval: an interval, expressed in seconds
-        :param result: returned when done sleeping
+        :param lead: how many seconds before the beginning to wake up
         :return: None
         """
-        now = time.time()
+        now = time.time() + lead
 
         # when is the next interval?
         when = ((now + interval) // interval) * interval
@@ -195,7 +613,12 @@ def main():
 
     while keep_ticking:
         clock.tick()
-        sleep_until_interval(1/60)
+        clock.render_ahead()
+        sleep_until_interval(clock.interval, clock.lead)
+
+    print(f"latency: {clock.latency}")
+    print(f"residual: {clock.residual} (lead {clock.lead*1e6:.1f}\xB5s)")
+    print(f"frames: {clock.pacing}")
 
     if args.clear:
         clock.clear()
@@ -0,0 +1,213 @@
+import ctypes, os, signal, sys, time
+import multiprocessing
+from multiprocessing import shared_memory
+
+from clock import Clock, Config as ClockConfig
+from scheduler import PrecisionSleeper, _next_interval
+
+# Runs the seven-segment clock in a process of its own, so that nothing
+# else we do (parsing gpsd's JSON, rendering OLED frames, waiting on
+# chronyc) can ever hold up a tick: not the event loop, and not the GIL.
+#
+# The rest of the program tells it what to show (local or UTC, blinking
+# separators or not, how bright) through a few bytes of shared memory,
+# which the clock process looks at once a frame.
+
+
+class Config:
+    # SCHED_FIFO priority (1-99), or None to leave the scheduler alone
+    PRIORITY = 50
+    # CPUs to pin the clock to, e.g. {3}; None for any
+    CPUS = None
+    # lock the clock's memory in RAM, so it's never paged out mid-tick
+    MLOCK = True
+
+    MCL_CURRENT = 1
+    MCL_FUTURE = 2
+
+
+class ClockState:
+    r"""The clock's settings, in a small block of shared memory.
+
+    :param name: the name of an existing block to attach to; if None,
+        a new one is created
+    """
+    LOCAL, BLINK, BRIGHTNESS, RUNNING = range(4)
+    SIZE = 4
+
+    def __init__(self, name=None):
+        self.owner = name is None
+        # (a spawned child shares its parent's resource tracker, so
+        #  attaching doesn't leave the child responsible for the block)
+        self.shm = shared_memory.SharedMemory(name, create=self.owner, size=self.SIZE)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _get(self, index):
+        return self.shm.buf[index]
+
+    def _set(self, index, value):
+        self.shm.buf[index] = int(value)
+
+    local = property(
+        lambda self: bool(self._get(self.LOCAL)),
+        lambda self, v: self._set(self.LOCAL, v),
+    )
+    blink = property(
+        lambda self: bool(self._get(self.BLINK)),
+        lambda self, v: self._set(self.BLINK, v),
+    )
+    brightness = property(
+        lambda self: self._get(self.BRIGHTNESS),
+        lambda self, v: self._set(self.BRIGHTNESS, v),
+    )
+    running = property(
+        lambda self: bool(self._get(self.RUNNING)),
+        lambda self, v: self._set(self.RUNNING, v),
+    )
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class ClockProcess:
+    r"""The clock, running in its own process.
+
+    Offers the parts of Clock's interface that the rest of the program
+    uses to change its settings.
+
+    :param bus: a picklable callable that opens the I2C bus, in the
+        clock's process; by default, board.I2C
+    """
+    def __init__(self, addrs,
+            brightness=ClockConfig.BRIGHTNESS,
+            blink=ClockConfig.BLINK_SEPARATORS,
+            local=ClockConfig.LOCAL_TIME,
+            mode=ClockConfig.MODE,
+            priority=Config.PRIORITY,
+            cpus=Config.CPUS,
+            mlock=Config.MLOCK,
+            bus=None,
+        ):
+        self.state = ClockState()
+        self.state.local = local
+        self.state.blink = blink
+        self.state.brightness = brightness
+        self.state.running = True
+
+        # spawn, not fork: we're likely forking from inside an event loop
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(
+            target=_run,
+            args=(self.state.name, addrs, mode, priority, cpus, mlock, bus),
+            name="clock",
+            daemon=True,
+        )
+
+    @property
+    def local(self):
+        return self.state.local
+
+    @property
+    def blink(self):
+        return self.state.blink
+
+    @property
+    def brightness(self):
+        return self.state.brightness
+
+    def start(self):
+        self.process.start()
+
+    def stop(self, timeout=1):
+        r"""Stop the clock (which clears it), and wait for it to finish."""
+        self.state.running = False
+        if self.process.pid is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.state.close()
+
+    def toggle_local(self):
+        self.state.local = not self.state.local
+
+    def toggle_blink(self):
+        self.state.blink = not self.state.blink
+
+    def increase_brightness(self):
+        self.state.brightness = min(self.state.brightness + 1, 16)
+
+    def decrease_brightness(self):
+        self.state.brightness = max(self.state.brightness - 1, 0)
+
+
+def _realtime(priority, cpus, mlock):
+    r"""Make this process as real-time as we're allowed to."""
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    if priority:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        except PermissionError:
+            print("clock: not allowed SCHED_FIFO; carrying on without")
+    if mlock:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.mlockall(Config.MCL_CURRENT | Config.MCL_FUTURE) != 0:
+            print(f"clock: mlockall failed: {os.strerror(ctypes.get_errno())}")
+
+
+def _run(name, addrs, mode, priority, cpus, mlock, bus):
+    # SIGINT goes to the whole process group; let the parent decide
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # (and SIGUSR1, asking the parent for a report, might too; by default
+    #  it'd kill us, without even clearing the display)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+    state = ClockState(name)
+    # (not before there's a state for it to stop; until then, SIGTERM
+    #  just kills us, which is fine, as there's nothing to clean up)
+    signal.signal(signal.SIGTERM, lambda *_: setattr(state, 'running', False))
+    _realtime(priority, cpus, mlock)
+
+    if bus is None:
+        import board
+        bus = board.I2C
+    clock = Clock(
+        bus(), *addrs,
+        brightness=state.brightness,
+        blink=state.blink,
+        local=state.local,
+        mode=mode,
+    )
+    sleeper = PrecisionSleeper()
+
+    try:
+        while state.running:
+            if state.local != clock.local:
+                clock.toggle_local()
+            if state.blink != clock.blink:
+                clock.toggle_blink()
+            if state.brightness != clock.brightness:
+                clock.set_brightness(state.brightness)
+
+            clock.tick()
+            clock.render_ahead()
+
+            # early enough that the write's done on the boundary
+            lead = clock.lead
+            when = _next_interval(time.time() + lead, clock.interval) - lead
+            time.sleep(max(sleeper.early(when) - time.time(), 0))
+            sleeper.arrive(when)
+    finally:
+        clock.clear()
+        print(f"clock lateness: {sleeper.lateness}")
+        print(f"clock latency: {clock.latency}")
+        print(f"clock residual: {clock.residual} (lead {clock.lead*1e6:.1f}\xB5s)")
+        print(f"clock frames: {clock.pacing}")
+        sys.stdout.flush()
+        state.close()
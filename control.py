@@ -1,5 +1,7 @@
-import time, asyncio, signal, contextlib, json, sys
+import os, time, asyncio, signal, contextlib, json, sys
+from functools import partial
 from collections import defaultdict
+from collections.abc import Coroutine
 
 import systemd.daemon
 import board
@@ -8,14 +10,31 @@ from multibutton_debouncer import MultiButton
 
 from gps import GPS, AntennaStatus, GPSMode
 from chrony import ChronycTracking
-from clock import Clock
+from clock import Clock, ClockMode
+from clock_process import ClockProcess
+from scheduler import PrecisionSleeper, Scheduler
+from histogram import LogHistogram
 from oled import OLED
+from renderer import Renderer
+from scene import Scene, Shot
+from fontfit import FontIndex
+import render_cache
+from i2c_arbiter import I2CArbiter
+from i2c_dev import open_i2c
 from led import LED
 
 from util import dotdict
 from sexagesimal import DecDotSex
 
 class Config:
+    i2c = dotdict(
+        # 'blinka' for board.I2C(), or 'dev' to use /dev/i2c-N directly
+        transport = 'blinka',
+        bus = 1,
+        # everything on the bus goes through one I2CArbiter; False to let
+        #  each device use the bus directly, as it sees fit
+        arbiter = True,
+    )
     buttons = dotdict(
         top = board.D18,
         bottom = board.D5
@@ -24,18 +43,35 @@ class Config:
         i2c = (0x70, 0x71),
         brightness = 12,  # 0 .. 16
         blink = True,
-        local = True
+        local = True,
+        mode = ClockMode.THIRDS,  # or HUNDREDTHS, or FOURTHS
+        # sleep-then-spin to hit each third on time; False for plain sleep
+        precise = True,
+        guard = 0.002,  # seconds; the starting point, anyway
+        # run the clock in a real-time process of its own
+        process = dotdict(
+            enabled = False,
+            priority = 50,  # SCHED_FIFO; None to not ask
+            cpus = None,  # e.g. {3}, to keep the clock on a core of its own
+            mlock = True,
+        ),
     )
     oled = dotdict(
+        # processes rendering frames off the event loop; 0 for none (and
+        #  render on the loop)
+        render_workers = 1,
+        # values are shown in the biggest of these fonts that fits
+        fonts = '/home/ptolemarch/gps-clock/fonts',
+        # glyph atlases and frames that never change, worked out once and
+        #  kept here (next to this script, since the service can write
+        #  there); None to work them out on every start
+        cache = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'render-cache.bin'
+        ),
         little = dotdict(
             i2c = 0x3c,
             size = (128, 32),
             font = dotdict(
-                value_8='/home/ptolemarch/gps-clock/fonts/profont/ProFont_r400-29.pil',
-                value_11='/home/ptolemarch/gps-clock/fonts/profont/ProFont_r400-22.pil',
-                value_13='/home/ptolemarch/gps-clock/fonts/ProFontmedium-17.pil',
-                value_18='/home/ptolemarch/gps-clock/fonts/profont/ProFont_r400-15.pil',
-                value_n='/home/ptolemarch/gps-clock/fonts/profont/ProFont_r400-12.pil',
                 label='/home/ptolemarch/gps-clock/fonts/profont/ProFont_r400-11.pil',
             ),
         ),
@@ -50,6 +86,12 @@ class Config:
             ),
         ),
     )
+    monitor = dotdict(
+        interval = 0.01,  # seconds between checks on the event loop
+        # say so right away when one step of a task takes this long
+        #  (seconds); None to keep quiet until asked
+        warn = 0.05,
+    )
     led = dotdict(
         top = dotdict(
             pins = (board.D6, board.D12)
@@ -60,12 +102,121 @@ class Config:
     )
 
 
+class LoopMonitor:
+    r"""Keeps an eye on how well the event loop is keeping up.
+
+    Two measurements: how late the loop gets around to running callbacks
+    (checked every so often by scheduling one and seeing when it runs),
+    and how long each step of each task takes, since a task that doesn't
+    yield in a timely fashion is what makes everything else late. For
+    that, every task created once we're installed gets its coroutine
+    wrapped in a _TimedCoroutine.
+
+    :param interval: seconds between checks for lag
+    :param warn: print a warning whenever a step takes this many
+        seconds; None for never
+    """
+    def __init__(self, interval=Config.monitor.interval, warn=Config.monitor.warn):
+        self.interval = interval
+        self.warn = None if warn is None else int(warn * 1e9)
+        self.lag = LogHistogram()
+        self.steps = LogHistogram()
+        self.worst = defaultdict(int)  # task name -> longest step, in ns
+        self.loop = None
+        self.handle = None
+        self._factory = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._factory = self.loop.get_task_factory()
+        self.loop.set_task_factory(self._task_factory)
+        self._probe(self.loop.time())
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if self.loop is not None:
+            self.loop.set_task_factory(self._factory)
+            self.loop = None
+
+    def _probe(self, when):
+        now = self.loop.time()
+        self.lag.record(int((now - when) * 1e9))
+        when = now + self.interval
+        self.handle = self.loop.call_at(when, self._probe, when)
+
+    def _task_factory(self, loop, coro, **kwargs):
+        coro = _TimedCoroutine(coro, self)
+        if self._factory is not None:
+            return self._factory(loop, coro, **kwargs)
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    def step(self, duration):
+        r"""Note that a step of the current task took duration ns."""
+        self.steps.record(duration)
+        name = asyncio.current_task().get_name()
+        if duration > self.worst[name]:
+            self.worst[name] = duration
+        if self.warn is not None and duration >= self.warn:
+            print(f"event loop blocked {duration/1e6:.1f}ms by {name}")
+
+    def longest(self):
+        r"""The name of the task with the longest step, and its length."""
+        if not self.worst:
+            return None, 0
+        return max(self.worst.items(), key=lambda item: item[1])
+
+    def reset(self):
+        self.lag.reset()
+        self.steps.reset()
+        self.worst.clear()
+
+    def __str__(self):
+        name, duration = self.longest()
+        return (
+            f"lag {self.lag}; steps {self.steps};"
+            f" longest {duration/1e6:.1f}ms by {name}"
+        )
+
+
+class _TimedCoroutine(Coroutine):
+    r"""A coroutine that times each step of the one it wraps."""
+    def __init__(self, coro, monitor):
+        self.coro = coro
+        self.monitor = monitor
+
+    def send(self, value):
+        start = time.perf_counter_ns()
+        try:
+            return self.coro.send(value)
+        finally:
+            self.monitor.step(time.perf_counter_ns() - start)
+
+    def throw(self, *args):
+        start = time.perf_counter_ns()
+        try:
+            return self.coro.throw(*args)
+        finally:
+            self.monitor.step(time.perf_counter_ns() - start)
+
+    def close(self):
+        return self.coro.close()
+
+    def __await__(self):
+        return self.coro.__await__()
+
+    def __repr__(self):
+        return repr(self.coro)
+
+
 # set up button callbacks
 # - shut down (and restart?) whole system
 # - shut down (and restart?) this app
 class Control:
     def __init__(self):
-        self.i2c = board.I2C()
+        self.i2c = open_i2c(Config.i2c.transport, Config.i2c.bus)
+        self.arbiter = I2CArbiter(self.i2c) if Config.i2c.arbiter else None
 
         # this is starting to get inconsistent
         # - gps and tracking should work more similarly
@@ -73,225 +224,283 @@ class Control:
         #   initialized in their respective tasks
         self.gps = GPS()
         self.chronyc_tracking = defaultdict(str)
-        self.clock = Clock(
-            self.i2c,
-            *(Config.clock.i2c),
-            brightness=Config.clock.brightness,
-            blink=Config.clock.blink,
-            local=Config.clock.local,
-        )
+        if Config.clock.process.enabled:
+            # it opens its own I2C bus (so the arbiter can't help it)
+            self.clock = ClockProcess(
+                Config.clock.i2c,
+                brightness=Config.clock.brightness,
+                blink=Config.clock.blink,
+                local=Config.clock.local,
+                mode=Config.clock.mode,
+                priority=Config.clock.process.priority,
+                cpus=Config.clock.process.cpus,
+                mlock=Config.clock.process.mlock,
+                bus=partial(open_i2c, Config.i2c.transport, Config.i2c.bus),
+            )
+        else:
+            self.clock = Clock(
+                self.i2c,
+                *(Config.clock.i2c),
+                brightness=Config.clock.brightness,
+                blink=Config.clock.blink,
+                local=Config.clock.local,
+                mode=Config.clock.mode,
+                arbiter=self.arbiter,
+            )
         self.oled = dict(
             little = OLED(
                 Config.oled.little.size,
                 self.i2c,
                 Config.oled.little.i2c,
+                arbiter=self.arbiter,
             ),
             big = OLED(
                 Config.oled.big.size,
                 self.i2c,
                 Config.oled.big.i2c,
+                arbiter=self.arbiter,
             ),
         )
         self.led = dict(
             top = LED(*Config.led.top.pins),
             bottom = LED(*Config.led.bottom.pins),
         )
+        self.clock_sleeper = PrecisionSleeper(
+            precise=Config.clock.precise,
+            guard=Config.clock.guard,
+        )
+
+        self.fonts = FontIndex(Config.oled.fonts)
+        self.scenes = self.oled_scenes()
+        cache = Config.oled.cache
+        if cache:
+            writs = [writ for scene in self.scenes for writ in scene.writs()]
+            fonts = set(self.fonts.filenames) | {writ.font for writ in writs}
+            if render_cache.load(cache, sorted(fonts), writs) is None:
+                cache = None
+        # (after the cache, so that the workers are only told to use one
+        #  if there is one; they don't start until there's work anyway)
+        self.renderer = (
+            Renderer(
+                Config.oled.render_workers,
+                initializer=render_cache.install if cache else None,
+                initargs=(cache,) if cache else (),
+            )
+            if Config.oled.render_workers else None
+        )
+        for oled in self.oled.values():
+            oled.renderer = self.renderer
 
+        self.chronyc = ChronycTracking()
+        self.stratum = 0
+        self.antenna = AntennaStatus.UNKNOWN
+
+        self.scheduler = None
+        self.monitor = LoopMonitor()
         self.tasks = list()
 
     def stop(self):
         for t in self.tasks:
             t.cancel()
 
-    async def run(self):
-        self.tasks = [asyncio.create_task(aw[1], name=aw[0]) for aw in (
-            ("systemd", self.systemd_task()),
-            ("gps", self.gps_task()),
-            ("chronyc_tracking", self.chronyc_tracking_task()),
-            ("buttons", self.buttons_task()),
-            ("clock", self.clock_task()),
-            ("little_oled", self.little_oled_task()),
-            ("big_oled", self.big_oled_task()),
-            ("top_led", self.top_led_task()),
-            ("bottom_led", self.bottom_led_task()),
-        )]
-
-        await asyncio.gather(*(self.tasks))
-
-    async def systemd_task(self):
-        systemd.daemon.notify('READY=1')
-        while True:
-            await asyncio.sleep(1)
-            systemd.daemon.notify('WATCHDOG=1')
-
-    async def gps_task(self):
-        await self.gps.run()
+    def report(self):
+        if isinstance(self.clock, ClockProcess):
+            # it reports for itself when it stops
+            print(f"clock: in process {self.clock.process.pid}")
+        else:
+            print(f"clock lateness: {self.clock_sleeper.lateness}")
+            print(f"clock latency: {self.clock.latency}")
+            print(f"clock residual: {self.clock.residual}"
+                f" (lead {self.clock.lead*1e6:.1f}\xB5s)")
+            print(f"clock frames: {self.clock.pacing}")
+        if self.scheduler is not None:
+            print(f"scheduler: {self.scheduler}")
+        if self.arbiter is not None:
+            print(f"i2c: {self.arbiter}")
+        if self.renderer is not None:
+            print(f"renderer: {self.renderer}")
+        print(f"event loop: {self.monitor}")
+        sys.stdout.flush()
 
-    async def chronyc_tracking_task(self):
-        async for t in ChronycTracking():
-            self.chronyc_tracking = t
-            await self.sleep_until_interval(5)
+    async def run(self):
+        # before anything else, so it gets to time every task
+        self.monitor.start()
 
-    async def buttons_task(self):
         t = Config.buttons.top
         b = Config.buttons.bottom
-        buttons = MultiButton(t, b)
-        buttons.set_callback([t, b], "_", lambda: self.clock.toggle_local())
-        while True:
-            await self.sleep_until_interval(1/60)
-            buttons.poll()
+        self.buttons = MultiButton(t, b)
+        self.buttons.set_callback([t, b], "_", lambda: self.clock.toggle_local())
+
+        # everything periodic shares the one timer heap
+        self.scheduler = Scheduler.shared()
+        every = self.scheduler.every
+        if isinstance(self.clock, ClockProcess):
+            self.clock.start()
+        else:
+            self.ticking = every(
+                self.clock.interval, self.clock_job,
+                sleeper=self.clock_sleeper, priority=-1
+            )
+            self.scheduler.on_step.append(self.clock_stepped)
+        every(1/60, self.buttons.poll)
+        every(1, self.systemd_job)
+        every(5, self.chronyc_tracking_job)
+        for scene in self.scenes:
+            scene.start(self.scheduler)
+        every(1, self.top_led_job)
+        every(1, self.bottom_led_job)
+
+        # start rendering what the OLEDs will show as soon as we know it
+        self.gps.on_update.append(self.prerender)
 
-    async def clock_task(self):
-        try:
-            while True:
-                self.clock.tick()
-                await self.sleep_until_interval(1/60)
-        finally:
-            self.clock.clear()
+        systemd.daemon.notify('READY=1')
+        self.tasks = [
+            asyncio.create_task(self.gps_task(), name="gps"),
+            self.scheduler.start(),
+        ]
+        if self.arbiter is not None:
+            self.tasks.append(self.arbiter.start())
 
-    async def little_oled_task(self):
-        oled = self.oled['little']
         try:
-            while True:
-                # four-second loop
-                await self.sleep_until_interval(4)
-                await oled.write('top', Config.oled.little.font.label, (
-                    "PPS Offset",
-                ))
-                await asyncio.sleep(0.5)
-
-                text = "\xB1\xBF\xD8?\xB5s"
-                with contextlib.suppress(TypeError, ValueError):
-                    offset = self.gps.info['pps_offset_usec']
-                    text = "%+4.3f\xB5s"%(offset)
-
-                # TODO: just realized that this should instead be, like,
-                # converting from usec to sec to minutes, etc.
-                length = len(text)
-                if length <= 8:
-                    font = Config.oled.little.font.value_8
-                elif length <= 11:
-                    # This barely fits 11 characters, and I'm okay with that.
-                    # (The +/- at the front will be slightly cut off.)
-                    font = Config.oled.little.font.value_11
-                elif length <= 13:
-                    font = Config.oled.little.font.value_13
-                elif length <= 18:
-                    font = Config.oled.little.font.value_18
-                else:
-                    font = Config.oled.little.font.value_n
-
-                # the comma at the end is *not* optional, for Python reasons
-                # TODO: it'd be awfully nice to fix that
-                await oled.write('bottom', font, (
-                    text,
-                ))
-
-                await asyncio.sleep(1)
-                await oled.clear()
+            await asyncio.gather(*(self.tasks))
         finally:
-            await oled.clear()
+            for scene in self.scenes:
+                scene.stop()
+            if isinstance(self.clock, ClockProcess):
+                self.clock.stop()
+            else:
+                self.clock.clear()
+            for oled in self.oled.values():
+                await oled.clear()
+            for led in self.led.values():
+                led.off()
+            self.monitor.stop()
+            if self.renderer is not None:
+                self.renderer.close()
+            self.report()
 
-    async def big_oled_task(self):
-        oled = self.oled['big']
-        try:
-            while True:
-                # four-second loop, but start on second 2
-                await self.sleep_until_interval(4, 2)
-                await oled.write('top', Config.oled.big.font.label, (
+    def systemd_job(self):
+        systemd.daemon.notify('WATCHDOG=1')
+
+    async def gps_task(self):
+        await self.gps.run()
+
+    async def chronyc_tracking_job(self):
+        self.chronyc_tracking = await self.chronyc.__anext__()
+
+    def clock_job(self):
+        self.clock.tick()
+        self.clock.render_ahead()
+        # the clock may have decided to skip frames (or stop skipping them)
+        self.ticking.interval = self.clock.interval
+        # and start early enough that the write's done on the boundary
+        self.ticking.offset = -self.clock.lead
+
+    def clock_stepped(self):
+        print("wall clock stepped; redrawing")
+        self.clock.stepped()
+        self.clock_job()
+
+    def oled_scenes(self):
+        little = Config.oled.little.font
+        big = Config.oled.big.font
+        return (
+            Scene(self.oled['little'], name="little_oled", shots=(
+                Shot(0, 'top', little.label, ("PPS Offset",)),
+                Shot(0.5, 'bottom', value=self.little_oled_value),
+                Shot(1.5),
+            )),
+            # four-second loop, but start on second 2
+            Scene(self.oled['big'], name="big_oled", offset=2, shots=(
+                Shot(0, 'top', big.label, (
                     'Latitude',
                     'Longitude',
                     'Altitude     Sats',
-                ))
-                await asyncio.sleep(0.5)
-
-                # TODO: this is gonna want real __format__ support someday
-                with contextlib.suppress(TypeError, ValueError):
-                    await oled.write('bottom', Config.oled.big.font.value, (
-                        ' ' + str(DecDotSex(self.gps.info['latitude'])),
-                        str(DecDotSex(self.gps.info['longitude'])),
-                        str(self.gps.info['altitude'])
-                        + '  ' + str(self.gps.info['satellites_used'])
-                        + '/' + str(self.gps.info['satellites'])
-                        # TODO: it'd be awfully nice to fix this:
-                        , # non-optional comma!
-                    ))
-                await asyncio.sleep(1)
-                await oled.clear()
-        finally:
-            await oled.clear()
+                )),
+                Shot(0.5, 'bottom', value=self.big_oled_value),
+                Shot(1.5),
+            )),
+        )
 
-    async def top_led_task(self):
-        led = self.led['top']
-        stratum = 0
-        try:
-            while True:
-                await self.sleep_until_interval(1)
-
-                try:
-                    new_stratum = int(self.chronyc_tracking['Stratum'])
-                except ValueError:
-                    new_stratum = 0
-
-                if new_stratum == stratum:
-                    continue
-                stratum = new_stratum
-
-                if stratum == 0:
-                    led.off()
-                elif stratum == 1:
-                    led.green()
-                elif stratum > 1:
-                    led.amber()
-                elif stratum == AntennaStatus.SHORTED:
-                    led.red()
-        finally:
-            led.off()
+    def prerender(self, info=None):
+        self.oled['little'].prefetch('bottom', *self.little_oled_value())
+        big = self.big_oled_value()
+        if big is not None:
+            self.oled['big'].prefetch('bottom', *big)
 
-    async def bottom_led_task(self):
-        led = self.led['bottom']
-        antenna = AntennaStatus.UNKNOWN
-        try:
-            while True:
-                await self.sleep_until_interval(1)
-
-                new_antenna = self.gps.info['antenna']
-                if new_antenna == antenna:
-                    continue
-                antenna = new_antenna
-
-                if antenna == AntennaStatus.UNKNOWN:
-                    led.off()
-                elif antenna == AntennaStatus.EXTERNAL:
-                    led.green()
-                elif antenna == AntennaStatus.INTERNAL:
-                    led.amber()
-                elif antenna == AntennaStatus.SHORTED:
-                    led.red()
-        finally:
-            led.off()
+    def little_oled_value(self):
+        r"""What the little OLED will show next.
 
+        :return: (font, text)
+        """
+        text = "\xB1\xBF\xD8?\xB5s"
+        with contextlib.suppress(TypeError, ValueError):
+            offset = self.gps.info['pps_offset_usec']
+            text = "%+4.3f\xB5s"%(offset)
+
+        # TODO: just realized that this should instead be, like,
+        # converting from usec to sec to minutes, etc.
 
-    async def sleep_until_interval(self, interval, offset=0, result=None, debug=None):
-        r"""Given an interval, sleep until the beginning of the next whole
-        interval.
+        # (one line, but fit() and the frame both want a tuple of lines)
+        text = (text,)
+        font = self.fonts.fit(text, Config.oled.little.size) or self.fonts.smallest
+        return font, text
 
-        :param interval: an interval, expressed in seconds
-        :param result: returned when done sleeping
-        :return: None
+    def big_oled_value(self):
+        r"""What the big OLED will show next, or None if we don't know.
+
+        :return: (font, text)
         """
-        now = time.time()
+        # TODO: this is gonna want real __format__ support someday
+        with contextlib.suppress(TypeError, ValueError):
+            return Config.oled.big.font.value, (
+                ' ' + str(DecDotSex(self.gps.info['latitude'])),
+                str(DecDotSex(self.gps.info['longitude'])),
+                str(self.gps.info['altitude'])
+                + '  ' + str(self.gps.info['satellites_used'])
+                + '/' + str(self.gps.info['satellites'])
+                # TODO: it'd be awfully nice to fix this:
+                , # non-optional comma!
+            )
+        return None
+
+    def top_led_job(self):
+        led = self.led['top']
 
-        # when is the next interval?
-        when = ((now + interval) // interval) * interval
-        delay = (when + offset) - now
+        try:
+            new_stratum = int(self.chronyc_tracking['Stratum'])
+        except ValueError:
+            new_stratum = 0
+
+        if new_stratum == self.stratum:
+            return
+        stratum = self.stratum = new_stratum
+
+        if stratum == 0:
+            led.off()
+        elif stratum == 1:
+            led.green()
+        elif stratum > 1:
+            led.amber()
+        elif stratum == AntennaStatus.SHORTED:
+            led.red()
+
+    def bottom_led_job(self):
+        led = self.led['bottom']
+
+        new_antenna = self.gps.info['antenna']
+        if new_antenna == self.antenna:
+            return
+        antenna = self.antenna = new_antenna
 
-        if debug:
-            print(f'( {now} + {interval} ) = {now + interval}')
-            print(f'( {now} + {interval} ) // interval = {(now + interval) // interval}')
-            print(f'( ( {now} + {interval} ) // interval ) * interval ) = {((now + interval) // interval) * interval}')
-            print(f'sleep for {delay}s; when:{when}; offset:{offset}; now:{now}')
-        return await asyncio.sleep(delay, result=result)
+        if antenna == AntennaStatus.UNKNOWN:
+            led.off()
+        elif antenna == AntennaStatus.EXTERNAL:
+            led.green()
+        elif antenna == AntennaStatus.INTERNAL:
+            led.amber()
+        elif antenna == AntennaStatus.SHORTED:
+            led.red()
 
 
 async def main():
@@ -309,6 +518,10 @@ async def main():
     # pretty wrong, and this won't help much anyway. But here goes.
     loop.add_signal_handler(signal.SIGABRT, control.stop)
 
+    # `systemctl kill --kill-whom=main -s USR1 gps-clock` to see how the
+    #  clock's doing (just main: SIGUSR1 would kill gpspipe, chronyc, etc.)
+    loop.add_signal_handler(signal.SIGUSR1, control.report)
+
     with contextlib.suppress(asyncio.CancelledError):
         await control.run()
 
@@ -0,0 +1,77 @@
+import os
+from functools import lru_cache
+
+import glyphs
+
+# Picking the biggest font that'll fit, by actually measuring.
+#
+# Measuring text in a bitmap font needs nothing but how far each glyph
+# moves the pen (which is what PIL's getbbox adds up, too), and the font's
+# height. So every font gets indexed once, up front, as its height and
+# those 256 advances; fitting is then some additions per font, and for a
+# string we've fitted before, not even that.
+
+
+class FontIndex:
+    r"""The sizes of all the PIL fonts in a directory (and below it).
+
+    :param directory: where to look
+    """
+    def __init__(self, directory):
+        self.fonts = list()  # (height, advances, filename), tallest first
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if not name.endswith('.pil'):
+                    continue
+                filename = os.path.join(root, name)
+                glyph_metrics = glyphs.metrics(filename)
+                top = min(m[3] for m in glyph_metrics)
+                bottom = max(m[5] for m in glyph_metrics)
+                advances = tuple(m[0] for m in glyph_metrics)
+                self.fonts.append((bottom - top, advances, filename))
+        # (ties go by name, so that the choice doesn't depend on the order
+        #  os.walk() found them in)
+        self.fonts.sort(key=lambda font: (font[0], font[2]), reverse=True)
+
+    @property
+    def filenames(self):
+        return [filename for _, _, filename in self.fonts]
+
+    @property
+    def smallest(self):
+        return self.fonts[-1][2] if self.fonts else None
+
+    def measure(self, filename, text):
+        r"""The size of some lines of text in a font.
+
+        :return: (width, height), as PIL would have it
+        """
+        for height, advances, name in self.fonts:
+            if name == filename:
+                return self._measure(height, advances, text)
+        raise KeyError(filename)
+
+    @staticmethod
+    def _measure(height, advances, text):
+        width = max(
+            sum(advances[c] for c in line.encode('latin-1'))
+            for line in text
+        )
+        return width, height * len(text)
+
+    @lru_cache(maxsize=1024)
+    def fit(self, text, size):
+        r"""The biggest font that some lines of text fit in.
+
+        :param text: a tuple of lines
+        :param size: (width, height) to fit them in
+        :return: a font's filename, or None if even the smallest is too
+            big
+        """
+        width, height = size
+        for font_height, advances, filename in self.fonts:
+            if font_height * len(text) > height:
+                continue
+            if self._measure(font_height, advances, text)[0] <= width:
+                return filename
+        return None
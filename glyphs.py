@@ -0,0 +1,253 @@
+import os
+
+# Text for the OLEDs, without PIL (once the font's loaded, anyway).
+#
+# Drawing a line of text with PIL means a new Image, a new ImageDraw, a
+# getbbox() and a draw.text(), and then (in adafruit_ssd1306.image()) a
+# walk over every pixel to turn it into the SSD1306's page layout. The PPS
+# offset changes every time we show it, so none of that can be cached.
+#
+# Instead, each font is taken apart once into its glyphs, and each glyph
+# into its columns of pixels, each column an int (bit 0 the top row of the
+# line). A line of text is then those columns, one glyph after another; a
+# whole screen is the lines' columns shifted down to where the lines go
+# and ORed together; and the SSD1306's page layout is each column's int
+# as little-endian bytes, one per page, which is just int.to_bytes().
+#
+# Glyphs go where PIL would put them, so that what's on the OLEDs doesn't
+# change: laid out the same way PIL lays out text in its own bitmap fonts
+# (.pil, converted from BDF by pilfont.py), or BDF fonts as pilfont.py
+# would convert them.
+
+
+class Glyph:
+    r"""One character of a font.
+
+    :param dx: how far to move right, afterwards
+    :param left: the first column of the glyph, relative to the pen
+    :param columns: its pixels, one int per column, shifted to their
+        place in the line (bit 0 at the top of the line)
+    :param mask: the rows of the line the glyph covers (PIL pastes
+        glyphs, so a glyph's blank pixels overwrite whatever came before)
+    """
+    __slots__ = ('dx', 'left', 'columns', 'mask')
+
+    def __init__(self, dx, left, columns, mask):
+        self.dx = dx
+        self.left = left
+        self.columns = columns
+        self.mask = mask
+
+
+class Atlas:
+    r"""A bitmap font, taken apart into glyph columns.
+
+    :param glyphs: for each of 256 characters (Latin-1), a tuple of
+        (dx, (x0, y0, x1, y1), rows), where the box is where the glyph
+        goes relative to the pen on the baseline, and rows are ints, one
+        per row, with the leftmost pixel in the highest bit
+    """
+    def __init__(self, glyphs):
+        # PIL puts the baseline as far down as the tallest glyph needs
+        top = min((box[1] for _, box, _ in glyphs), default=0)
+        bottom = max((box[3] for _, box, _ in glyphs), default=0)
+        self.baseline = -top
+        self.height = bottom - top
+
+        self.glyphs = list()
+        for dx, (x0, y0, x1, y1), rows in glyphs:
+            width = x1 - x0
+            columns = list()
+            for x in range(width):
+                bit = 1 << (width - 1 - x)
+                column = 0
+                for y, row in enumerate(rows):
+                    if row & bit:
+                        column |= 1 << (self.baseline + y0 + y)
+                columns.append(column)
+            mask = ((1 << (y1 - y0)) - 1) << (self.baseline + y0)
+            self.glyphs.append(Glyph(dx, x0, columns, mask))
+
+    @classmethod
+    def restore(cls, baseline, height, glyphs):
+        r"""An Atlas from its parts, as already worked out before.
+
+        :param glyphs: a list of 256 Glyphs
+        """
+        atlas = cls.__new__(cls)
+        atlas.baseline = baseline
+        atlas.height = height
+        atlas.glyphs = glyphs
+        return atlas
+
+    def width(self, text):
+        r"""How wide a line of text is, in pixels (as PIL's getbbox has it)."""
+        glyphs = self.glyphs
+        return sum(glyphs[c].dx for c in text.encode('latin-1'))
+
+    def line(self, text):
+        r"""A line of text, as a list of column ints."""
+        glyphs = self.glyphs
+        encoded = text.encode('latin-1')
+        columns = [0] * sum(glyphs[c].dx for c in encoded)
+        width = len(columns)
+        x = 0
+        for c in encoded:
+            glyph = glyphs[c]
+            keep = ~glyph.mask
+            at = x + glyph.left
+            for column in glyph.columns:
+                if 0 <= at < width:
+                    columns[at] = (columns[at] & keep) | column
+                at += 1
+            x += glyph.dx
+        return columns
+
+
+def metrics(filename):
+    r"""The metrics of each glyph of a PIL font, without its bitmaps.
+
+    :return: for each of 256 characters, (dx, dy, x0, y0, x1, y1, sx0,
+        sy0, sx1, sy1): how far to move the pen, where the glyph goes
+        relative to it, and where it is in the font's bitmap
+    """
+    with open(filename, 'rb') as f:
+        if f.readline() != b"PILfont\n":
+            raise ValueError(f"not a PIL font: {filename}")
+        while True:
+            line = f.readline()
+            if not line or line == b"DATA\n":
+                break
+        data = f.read(256 * 20)
+
+    def signed(i):
+        n = int.from_bytes(data[i:i+2], 'big')
+        return n - 0x10000 if n & 0x8000 else n
+
+    return [
+        tuple(signed(c * 20 + 2 * i) for i in range(10))
+        for c in range(256)
+    ]
+
+
+def _pil(filename):
+    r"""The glyphs of a PIL font (and the image that goes with it)."""
+    width, height, pixels = _bitmap(filename)
+    stride = (width + 7) // 8
+
+    glyphs = list()
+    for dx, dy, x0, y0, x1, y1, sx0, sy0, sx1, sy1 in metrics(filename):
+        rows = list()
+        for y in range(sy0, sy1):
+            row = int.from_bytes(pixels[y * stride:(y + 1) * stride], 'big')
+            # keep just the glyph's own columns
+            row >>= stride * 8 - sx1
+            rows.append(row & ((1 << (sx1 - sx0)) - 1))
+        glyphs.append((dx, (x0, y0, x1, y1), rows))
+    return glyphs
+
+
+def _bitmap(filename):
+    r"""Read the image of a PIL font's glyphs.
+
+    Whatever pilfont.py called it, it's likely a PNG, so PIL reads it
+    (once, when the font's loaded; it's not needed after that).
+
+    :return: (width, height, pixels), where pixels are packed rows, eight
+        pixels to a byte, leftmost in the highest bit, with 1 for ink
+    """
+    from PIL import Image
+    root = os.path.splitext(filename)[0]
+    for extension in ('.png', '.gif', '.pbm'):
+        try:
+            image = Image.open(root + extension)
+        except OSError:
+            continue
+        with image:
+            image = image.convert('1')
+            return (*image.size, image.tobytes())
+    raise ValueError(f"no glyph image for {filename}")
+
+
+def _bdf(filename):
+    r"""The glyphs of a BDF font, placed as pilfont.py would place them."""
+    glyphs = [(0, (0, 0, 0, 0), [])] * 256
+    with open(filename, encoding='latin-1') as f:
+        lines = iter(f)
+        for line in lines:
+            if not line.startswith('STARTCHAR'):
+                continue
+            encoding = dx = box = None
+            for line in lines:
+                key, _, value = line.strip().partition(' ')
+                if key == 'ENCODING':
+                    encoding = int(value.split()[0])
+                elif key == 'DWIDTH':
+                    dx = int(value.split()[0])
+                elif key == 'BBX':
+                    box = tuple(map(int, value.split()))
+                elif key == 'BITMAP':
+                    break
+            width, height, x, y = box
+            rows = list()
+            for line in lines:
+                line = line.strip()
+                if line == 'ENDCHAR':
+                    break
+                # each row is padded out to whole bytes
+                bits = len(line) * 4
+                rows.append(int(line, 16) >> (bits - width))
+            if 0 <= encoding < 256:
+                glyphs[encoding] = (dx, (x, -y - height, x + width, -y), rows)
+    return glyphs
+
+
+# filename -> Atlas, for fonts that have already been taken apart
+_atlases = dict()
+
+
+def preload(filename, atlas):
+    r"""Use an Atlas (as from a render cache) for a font file."""
+    _atlases[filename] = atlas
+
+
+def load(filename):
+    r"""The Atlas for a font file (.pil, with its .pbm, or .bdf).
+
+    :raise ValueError: if it's not a kind of font we can take apart
+    """
+    atlas = _atlases.get(filename)
+    if atlas is not None:
+        return atlas
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.pil':
+        atlas = Atlas(_pil(filename))
+    elif extension == '.bdf':
+        atlas = Atlas(_bdf(filename))
+    else:
+        raise ValueError(f"no glyph atlas for {filename}")
+    _atlases[filename] = atlas
+    return atlas
+
+
+def compose(size, lines):
+    r"""Put lines of text on a screen.
+
+    :param size: (width, height) of the screen
+    :param lines: (x, y, columns) for each line, where columns are as
+        from Atlas.line()
+    :return: the screen, in the SSD1306's layout: a page (eight rows) at
+        a time, each a byte per column, with the top row in bit 0
+    """
+    width, height = size
+    pages = height // 8
+    screen = [0] * width
+    full = (1 << height) - 1
+    for x, y, columns in lines:
+        for column in columns:
+            if 0 <= x < width:
+                screen[x] |= (column << y if y >= 0 else column >> -y) & full
+            x += 1
+    # column by column, then page by page
+    columns = b''.join(column.to_bytes(pages, 'little') for column in screen)
+    return b''.join(columns[page::pages] for page in range(pages))
@@ -140,10 +140,18 @@ class GPS:
 
         self.info = defaultdict(str)  # we know nothing at first
         self.tracker = Tracker(self.cmd, GPSPipeParser())
+        # called with the new info, whenever there's news
+        self.on_update = list()
 
     async def run(self):
         async for gps in self.tracker:
             self.info = gps
+            for callback in self.on_update:
+                # (somebody else's trouble mustn't stop us tracking gpsd)
+                try:
+                    callback(gps)
+                except Exception as e:
+                    print(f"gps: {callback!r} failed: {e!r}")
 
 
 async def main():
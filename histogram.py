@@ -0,0 +1,104 @@
+from array import array
+
+class LogHistogram:
+    r"""A histogram with logarithmically-sized buckets, in fixed memory.
+
+    Values are integers, e.g., nanoseconds. Values below ``2**precision``
+    get a bucket each; above that, each power of two is split into
+    ``2**precision`` buckets, so that a bucket is never wider than
+    ``1/2**precision`` of the values in it. (That's about 6% with the
+    default precision, which is plenty to tell 2ms from 15ms.)
+
+    Anything at or above ``2**bits`` lands in the last bucket, and
+    anything negative in the first, though ``min`` and ``max`` are exact.
+    """
+    def __init__(self, precision=4, bits=36):
+        self.precision = precision
+        self.sub = 1 << precision
+        self.buckets = array('Q', bytes(8 * (bits - precision + 1) * self.sub))
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.buckets)):
+            self.buckets[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < self.sub:
+            return max(value, 0)
+        shift = value.bit_length() - self.precision - 1
+        return min(shift * self.sub + (value >> shift), len(self.buckets) - 1)
+
+    def _upper(self, index):
+        r"""The largest value that would land in the bucket at index."""
+        shift = max(index // self.sub - 1, 0)
+        mantissa = index - shift * self.sub
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value):
+        self.buckets[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        r"""Estimate a percentile.
+
+        :param p: the percentile, from 0 to 100
+        :return: the upper bound of the bucket the percentile falls in
+            (but never more than the largest value seen), or None if
+            nothing's been recorded
+        """
+        if not self.count:
+            return None
+        rank = self.count * p / 100
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(self._upper(index), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def summary(self):
+        return dict(
+            count = self.count,
+            p50 = self.percentile(50),
+            p99 = self.percentile(99),
+            p999 = self.percentile(99.9),
+            max = self.max,
+        )
+
+    def __str__(self):
+        if not self.count:
+            return "n=0"
+        usec = 1e3  # assuming nanoseconds
+        s = self.summary()
+        return (
+            f"n={s['count']}"
+            f" p50={s['p50']/usec:.1f}\xB5s"
+            f" p99={s['p99']/usec:.1f}\xB5s"
+            f" p99.9={s['p999']/usec:.1f}\xB5s"
+            f" max={s['max']/usec:.1f}\xB5s"
+        )
+
+
+if __name__ == '__main__':
+    import random
+
+    def main():
+        h = LogHistogram()
+        for _ in range(100_000):
+            h.record(int(random.lognormvariate(14, 0.5)))
+        print(h)
+
+    main()
@@ -0,0 +1,177 @@
+import asyncio, heapq, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+from itertools import count
+
+# One owner for the I2C bus.
+#
+# The clock, both OLEDs and anything else we hang off the bus all share
+# the one board.I2C(), and until now nothing coordinated them: a whole
+# OLED framebuffer could go out right when a clock frame was due. The
+# arbiter queues transactions by priority, so the most urgent always goes
+# next, and keeps count of how much of the bus each device is using.
+#
+# The transactions themselves are blocking I/O, so they're done on a
+# thread of the arbiter's own (one per bus, since the bus can only do one
+# thing at a time anyway), leaving the event loop free to get on with
+# gpsd and the buttons while an OLED page goes out.
+#
+# The clock can't wait for the event loop to come around, so it doesn't
+# queue at all: write_now() does its transaction on the spot, on the
+# caller's thread. At worst, it waits for whatever transaction is on the
+# bus to finish, which is why nothing else should be much more than a page
+# of an OLED.
+
+
+class Priority(IntEnum):
+    CLOCK = 0
+    NORMAL = 1  # LEDs, buttons, anything small
+    BULK = 2  # OLED frames
+
+
+class Transaction:
+    r"""Writes to one device, to be done one right after the other.
+
+    :param address: the device's I2C address
+    :param messages: each a bytes-like, written in its own I2C write
+    :param priority: lower goes first
+    """
+    __slots__ = ('address', 'messages', 'priority', 'future', 'queued')
+
+    def __init__(self, address, messages, priority=Priority.NORMAL):
+        self.address = address
+        self.messages = messages
+        self.priority = priority
+        self.future = None
+        self.queued = None
+
+    def __len__(self):
+        return sum(len(m) for m in self.messages)
+
+
+class DeviceStats:
+    def __init__(self):
+        self.transactions = 0
+        self.bytes = 0
+        self.busy = 0  # ns
+
+    def __str__(self):
+        return (
+            f"{self.transactions} transactions,"
+            f" {self.bytes} bytes, {self.busy/1e6:.1f}ms"
+        )
+
+
+class I2CArbiter:
+    r"""Owns the I2C bus, and decides who gets to use it next.
+
+    :param i2c: a busio.I2C (or anything with the same interface)
+    """
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.heap = list()
+        self.sequence = count()
+        self.stats = defaultdict(DeviceStats)
+        self.started = time.perf_counter_ns()
+        self.task = None
+        self._wakeup = None
+        # held while a transaction is on the bus
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="i2c")
+
+    def start(self):
+        # (start again if we've been cancelled: there may be some last
+        #  few things to do on the way out, like clearing displays)
+        if self.task is None or self.task.done():
+            self._wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run(), name="i2c arbiter")
+        return self.task
+
+    def submit(self, transaction):
+        r"""Queue a transaction.
+
+        :return: a future, done once the transaction has been done
+        """
+        self.start()
+        transaction.future = asyncio.get_running_loop().create_future()
+        transaction.queued = time.perf_counter_ns()
+        heapq.heappush(self.heap, (transaction.priority, next(self.sequence), transaction))
+        self._wakeup.set()
+        return transaction.future
+
+    async def write(self, address, *messages, priority=Priority.NORMAL):
+        r"""Queue writes to a device, and wait until they've been done."""
+        # shielded, since it's going out on the bus regardless
+        await asyncio.shield(self.submit(Transaction(address, messages, priority)))
+
+    def write_now(self, address, *messages):
+        r"""Write to a device right away, without queueing."""
+        self._perform(Transaction(address, messages, Priority.CLOCK))
+
+    async def call(self, function, *args):
+        r"""Call something that uses the bus, on the bus's thread.
+
+        For things that don't fit into a Transaction, like a driver's
+        initialization.
+        """
+        def locked():
+            with self.lock:
+                return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, locked)
+
+    def _perform(self, transaction):
+        i2c = self.i2c
+        with self.lock:
+            started = time.perf_counter_ns()
+            while not i2c.try_lock():
+                pass
+            try:
+                for message in transaction.messages:
+                    i2c.writeto(transaction.address, message)
+            finally:
+                i2c.unlock()
+            stats = self.stats[transaction.address]
+            stats.transactions += 1
+            stats.bytes += len(transaction)
+            stats.busy += time.perf_counter_ns() - started
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while not self.heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            _, _, transaction = heapq.heappop(self.heap)
+            future = transaction.future
+
+            try:
+                await loop.run_in_executor(self.executor, self._perform, transaction)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(None)
+
+    def utilization(self):
+        r"""The fraction of the time since we started (or were reset)
+        that each device has had the bus.
+
+        :return: a dict of address: fraction
+        """
+        elapsed = time.perf_counter_ns() - self.started
+        return {
+            address: stats.busy / elapsed
+            for address, stats in self.stats.items()
+        }
+
+    def reset(self):
+        self.stats.clear()
+        self.started = time.perf_counter_ns()
+
+    def __str__(self):
+        utilization = self.utilization()
+        return "; ".join(
+            f"0x{address:02x}: {utilization[address]:.1%} busy, {stats}"
+            for address, stats in sorted(self.stats.items())
+        )
@@ -0,0 +1,163 @@
+import ctypes, os, threading
+
+# Talking to /dev/i2c-N ourselves, rather than by way of Blinka.
+#
+# board.I2C() goes through busio, then Blinka's generic Linux I2C, then
+# Adafruit_PureIO's SMBus, which builds new ctypes structures (and copies
+# our data into new buffers) for every write. The I2CDev here has the same
+# interface as busio.I2C, so the Adafruit drivers can't tell the
+# difference, but it sets up its I2C_RDWR structures and buffers once, and
+# after that a write is a copy into a buffer we already have and one
+# ioctl.
+
+# from linux/i2c-dev.h and linux/i2c.h
+I2C_RDWR = 0x0707
+I2C_M_RD = 0x0001
+
+
+class Config:
+    BUS = 1  # /dev/i2c-1, the one on the Pi's header
+    # longest message we can send or receive; a whole 128x64 OLED frame,
+    #  with its 0x40 prefix, is 1025 bytes
+    BUFFER = 2048
+
+
+class i2c_msg(ctypes.Structure):
+    _fields_ = [
+        ('addr', ctypes.c_uint16),
+        ('flags', ctypes.c_uint16),
+        ('len', ctypes.c_uint16),
+        ('buf', ctypes.POINTER(ctypes.c_uint8)),
+    ]
+
+
+class i2c_rdwr_ioctl_data(ctypes.Structure):
+    _fields_ = [
+        ('msgs', ctypes.POINTER(i2c_msg)),
+        ('nmsgs', ctypes.c_uint32),
+    ]
+
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def _check(result):
+    if result < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return result
+
+
+class I2CDev:
+    r"""A busio.I2C work-alike for /dev/i2c-N.
+
+    :param bus: the N in /dev/i2c-N
+    :param size: the largest message, in bytes, we'll have to handle
+    """
+    def __init__(self, bus=Config.BUS, size=Config.BUFFER):
+        self.fd = os.open(f"/dev/i2c-{bus}", os.O_RDWR | os.O_CLOEXEC)
+        self.size = size
+        self._lock = threading.Lock()
+
+        # a write, and a read (for writeto_then_readfrom, the two go in one
+        #  I2C_RDWR, with a repeated start between them)
+        self._out = (ctypes.c_uint8 * size)()
+        self._in = (ctypes.c_uint8 * size)()
+        self._out_view = memoryview(self._out).cast('B')
+        self._in_view = memoryview(self._in).cast('B')
+        self._msgs = (i2c_msg * 2)()
+        self._msgs[0].buf = self._out
+        self._msgs[1].buf = self._in
+        self._msgs[1].flags = I2C_M_RD
+        self._data = i2c_rdwr_ioctl_data(self._msgs, 1)
+        self._data_ref = ctypes.byref(self._data)
+
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def deinit(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.deinit()
+
+    def _length(self, buffer, start, end):
+        end = len(buffer) if end is None else end
+        length = end - start
+        if length > self.size:
+            raise ValueError(f"{length} bytes is more than our {self.size}-byte buffer")
+        return end, length
+
+    def _transfer(self, count):
+        self._data.nmsgs = count
+        _check(_libc.ioctl(self.fd, I2C_RDWR, self._data_ref))
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        end, length = self._length(buffer, start, end)
+        self._out_view[:length] = memoryview(buffer).cast('B')[start:end]
+        out = self._msgs[0]
+        out.addr = address
+        out.flags = 0
+        out.len = length
+        self._transfer(1)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end, length = self._length(buffer, start, end)
+        # a read on its own goes in the first message
+        read = self._msgs[0]
+        read.addr = address
+        read.flags = I2C_M_RD
+        read.len = length
+        try:
+            self._transfer(1)
+        finally:
+            read.flags = 0
+        buffer[start:end] = self._out_view[:length]
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+            out_start=0, out_end=None, in_start=0, in_end=None):
+        out_end, out_length = self._length(buffer_out, out_start, out_end)
+        in_end, in_length = self._length(buffer_in, in_start, in_end)
+        self._out_view[:out_length] = memoryview(buffer_out).cast('B')[out_start:out_end]
+        out, read = self._msgs
+        out.addr = read.addr = address
+        out.flags = 0
+        out.len = out_length
+        read.len = in_length
+        self._transfer(2)
+        buffer_in[in_start:in_end] = self._in_view[:in_length]
+
+    def scan(self):
+        r"""The addresses of everything that answers a one-byte read."""
+        found = list()
+        probe = bytearray(1)
+        for address in range(0x08, 0x78):
+            try:
+                self.readfrom_into(address, probe)
+            except OSError:
+                continue
+            found.append(address)
+        return found
+
+
+def open_i2c(transport='blinka', bus=Config.BUS):
+    r"""Open the I2C bus.
+
+    :param transport: 'blinka' for board.I2C(), or 'dev' for an I2CDev
+    :param bus: the N in /dev/i2c-N (only for 'dev': Blinka decides for
+        itself)
+    """
+    if transport == 'dev':
+        return I2CDev(bus)
+    if transport == 'blinka':
+        import board
+        return board.I2C()
+    raise ValueError(f"unknown I2C transport: {transport}")
@@ -0,0 +1,52 @@
+import time
+import timeit
+
+from i2c_dev import open_i2c
+
+# Blinka's board.I2C() against our own I2CDev, on the bus writes we
+# actually do: a clock frame (a few bytes of HT16K33 display RAM) and a
+# page of OLED (addressing commands, then 128 bytes of pixels).
+
+if __name__ == '__main__':
+    CLOCK = 0x71
+    OLED = 0x3d
+
+    def writer(transport):
+        i2c = open_i2c(transport)
+        while not i2c.try_lock():
+            pass
+
+        ram = bytes((4, 0x02, 0, 0x3f, 0, 0x06))
+        address = bytes((0x00, 0x21, 0, 127, 0x22, 7, 7))
+        page = b'\x40' + bytes(128)
+
+        def clock_frame():
+            i2c.writeto(CLOCK, ram)
+
+        def oled_page():
+            i2c.writeto(OLED, address)
+            i2c.writeto(OLED, page)
+
+        return clock_frame, oled_page
+
+    def main():
+        blinka = writer('blinka')
+        dev = writer('dev')
+
+        number = 10_000
+
+        print(f"=== begun at {time.strftime('%c')}")
+
+        for _ in range(2):
+            for name, (clock_frame, oled_page) in (('blinka', blinka), ('dev', dev)):
+                print(f"--- {name} clock frame (x{number}):")
+                result = timeit.timeit(clock_frame, number=number)
+                print(f"    {result}  ({result / number * 1e6:.1f}\xB5s each)")
+
+                print(f"+++ {name} OLED page (x{number}):")
+                result = timeit.timeit(oled_page, number=number)
+                print(f"    {result}  ({result / number * 1e6:.1f}\xB5s each)")
+
+        print(f"=== ended at {time.strftime('%c')}")
+
+    main()
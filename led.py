@@ -8,11 +8,10 @@ import board
 class LED:
     SubLEDs = namedtuple('SubLEDs', ('red', 'green'))
 
-    def __init__(self, red, green):
-        self.sub_leds = self.SubLEDs(*(digitalio.DigitalInOut(pin) for pin in (red, green)))
+    def __init__(self, red, green, pin_class=digitalio.DigitalInOut):
+        self.sub_leds = self.SubLEDs(*(pin_class(pin) for pin in (red, green)))
         for pin in self.sub_leds:
-            pin.direction = digitalio.Direction.OUTPUT
-            pin.value = False
+            pin.switch_to_output(value=False)
 
     def off(self):
         self.sub_leds.red.value = False
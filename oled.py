@@ -1,13 +1,17 @@
 import asyncio, textwrap, board, digitalio, adafruit_ssd1306
-from functools import lru_cache
+from functools import lru_cache, partial
 from warnings import warn
 from dataclasses import dataclass
 from typing import Tuple
 from enum import Enum
 from math import floor
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 from textwrap import dedent
 
+from i2c_arbiter import Priority
+import glyphs
+
 #from clock import sleep_until_interval
 #from scheduler import run_in
 
@@ -109,6 +113,67 @@ def _gen_image(writ):
     return image
 
 
+# An image, in the SSD1306's own layout: a page (eight rows) at a time,
+#  each a byte per column, with the top row in bit 0. (Which is what
+#  ssd1306.image() does too, but a pixel at a time, in Python.)
+def _gen_pages(image):
+    width, height = image.size
+    pixels = np.asarray(image.convert("1"), dtype=bool)
+    # (pages, rows, columns) -> (pages, columns, rows), then each
+    #  column's eight rows packed into a byte
+    pages = pixels.reshape(height // 8, 8, width).transpose(0, 2, 1)
+    return np.packbits(pages, axis=-1, bitorder='little').tobytes()
+
+
+# Writ -> frame, for frames rendered before we even started (as from a
+#  render cache)
+_frames = dict()
+
+
+def preload(writ, frame):
+    r"""Use an already-rendered frame for a Writ."""
+    _frames[writ] = frame
+
+
+# A frame, ready to go to the SSD1306: the same layout as _gen_image(),
+#  but by way of glyph atlases, which is much cheaper than drawing with
+#  PIL. (Fonts that can't be made into an atlas get drawn by PIL anyway.)
+@lru_cache
+def _gen_frame(writ):
+    width, height = writ.size
+    align = writ.align
+    text = writ.text
+    try:
+        atlas = glyphs.load(writ.font)
+    except ValueError:
+        return _gen_pages(_gen_image(writ))
+
+    # (see _gen_image() for how the spacing works)
+    line_width = max(map(atlas.width, text))
+    line_height = atlas.height
+    line_count = len(text)
+
+    text_width = line_width
+    text_height = line_height * line_count
+
+    if text_width > width:
+        print(f"text wider than OLED: {text}")
+    if text_height > height:
+        print(f"text taller than OLED: {text}")
+
+    height_surplus = height - text_height
+    spacing = floor(height_surplus / line_count)
+
+    position_x = (0 if align == WritAlign.TOP else width - text_width)
+    position_y = (0 if align == WritAlign.TOP else spacing)
+    lines = list()
+    for t in text:
+        lines.append((position_x, position_y, atlas.line(t)))
+        position_y += line_height + spacing
+
+    return glyphs.compose(writ.size, lines)
+
+
 class OLED:
     def __init__(
         self,
@@ -117,48 +182,175 @@ class OLED:
         address,
         value_font_filename="fonts/uw-ttyp0-1.3/genbdf/t0-18-i01.pil",
         label_font_filename="fonts/uw-ttyp0-1.3/genbdf/t0-11-i01.pil",
+        arbiter=None,
+        renderer=None,
     ):
         self.size = size
         self.i2c = i2c
         self.address = address
+        # if there's an arbiter, frames go through it (at low priority)
+        self.arbiter = arbiter
+        # if there's a Renderer, frames are rendered by it, off the loop
+        self.renderer = renderer
+        # what we last sent, as it is in the SSD1306's RAM (page-major)
+        self.sent = None
+        # one frame at a time, so that what we've sent stays what we think
+        self.lock = asyncio.Lock()
         self.value_font_filename = value_font_filename
         self.label_font_filename = label_font_filename
-        self.__initialized = False
+        self.__initializing = None
 
     async def __initialize(self):
-        if self.__initialized:
-            return
-        self.__initialized = True
-
-        self.ssd1306 = adafruit_ssd1306.SSD1306_I2C(
+        # Whoever comes first starts it, and everybody (first included)
+        #  waits for that same attempt, since it takes a while, and the
+        #  SSD1306 isn't there to be used until it's done. (Shielded, so
+        #  that one of them being cancelled doesn't cancel it for all.)
+        if self.__initializing is None:
+            self.__initializing = asyncio.ensure_future(self.__make())
+        initializing = self.__initializing
+        try:
+            await asyncio.shield(initializing)
+        except Exception:
+            # maybe it'll work next time
+            if initializing.done() and self.__initializing is initializing:
+                self.__initializing = None
+            raise
+
+    async def __make(self):
+        # (a few dozen commands and a whole frame, so if there's an
+        #  arbiter, it's done on the bus's own thread)
+        make = partial(
+            adafruit_ssd1306.SSD1306_I2C,
             *self.size,
             self.i2c,
             addr=self.address
         )
+        if self.arbiter is not None:
+            self.ssd1306 = await self.arbiter.call(make)
+        else:
+            self.ssd1306 = make()
+        # it's cleared on initialization
+        self.sent = bytearray(len(self.ssd1306.buffer) - 1)
 
     async def clear(self):
         await self.__initialize()
-        self.ssd1306.fill(0)
-        self.ssd1306.show()
+        await self.__show_frame(self.blank())
 
     async def fill(self):
         await self.__initialize()
-        self.ssd1306.fill(1)
-        self.ssd1306.show()
-
-    async def __show(self, image):
-        self.ssd1306.image(image)
-        self.ssd1306.show()
+        await self.__show_frame(b'\xff' * len(self.blank()))
 
-    async def write(self, align, font, text):
+    async def show(self, image):
+        r"""Show a PIL image (the same size as the display)."""
         await self.__initialize()
-
-        await self.__show(_gen_image(Writ(
+        await self.__show_frame(_gen_pages(image))
+
+    async def __render(self, writ):
+        frame = _frames.get(writ)
+        if frame is not None:
+            return frame
+        if self.renderer is None:
+            return _gen_frame(writ)
+        return await self.renderer.render(writ)
+
+    async def __show_frame(self, frame):
+        # (the whole frame under the lock, framebuffer and all: otherwise
+        #  another frame could land in the framebuffer while this one's
+        #  pages were still being sent, and we'd send half of each)
+        async with self.lock:
+            # (the framebuffer starts with the 0x40 data prefix)
+            self.ssd1306.buffer[1:] = frame
+            for page, first, last in self.__changes():
+                await self.__send_page(page, first, last)
+
+    def __changes(self):
+        r"""Which parts of the framebuffer differ from what we last sent.
+
+        :return: a list of (page, first column, last column), for each
+            page that has changed
+        """
+        width, height = self.size
+        frame = self.ssd1306.buffer
+        sent = self.sent
+        changes = list()
+        for page in range(height // 8):
+            start = page * width
+            # (the framebuffer starts with the 0x40 data prefix)
+            new = frame[1 + start:1 + start + width]
+            old = sent[start:start + width]
+            if new == old:
+                continue
+            first = 0
+            while new[first] == old[first]:
+                first += 1
+            last = width - 1
+            while new[last] == old[last]:
+                last -= 1
+            changes.append((page, first, last))
+        return changes
+
+    async def __send_page(self, page, first, last):
+        # One page (eight rows) at a time, rather than the whole
+        #  framebuffer in one go, which would hold the bus for as long as
+        #  ~25ms: between pages, the event loop (and the arbiter) gets a
+        #  chance to send a clock frame.
+        width = self.size[0]
+        start = page * width
+        data = bytes(self.ssd1306.buffer[1 + start + first:1 + start + last + 1])
+        messages = (
+            # column and page address (Co=0, D/C#=0: all commands)
+            bytes((0x00, 0x21, first, last, 0x22, page, page)),
+            b'\x40' + data,
+        )
+        if self.arbiter is not None:
+            await self.arbiter.write(self.address, *messages, priority=Priority.BULK)
+        else:
+            device = self.ssd1306.i2c_device
+            with device:
+                for message in messages:
+                    device.write(message)
+            await asyncio.sleep(0)
+        self.sent[start + first:start + last + 1] = data
+
+    def prefetch(self, align, font, text):
+        r"""Get a frame rendering, so that it's ready to write() later.
+
+        Does nothing if there's no Renderer.
+        """
+        if self.renderer is not None:
+            self.renderer.prefetch(Writ(
+                size=self.size,
+                align=WritAlign(align),
+                font=font,
+                text=text
+            ))
+
+    async def render(self, align, font, text):
+        r"""Render a frame, to show_frame() later.
+
+        :return: the frame, in the SSD1306's page layout
+        """
+        return await self.__render(Writ(
             size=self.size,
             align=WritAlign(align),
             font=font,
             text=text
-        )))
+        ))
+
+    def blank(self):
+        r"""A frame with nothing on it."""
+        width, height = self.size
+        return bytes(width * height // 8)
+
+    async def show_frame(self, frame):
+        r"""Show a frame, as from render()."""
+        await self.__initialize()
+        await self.__show_frame(frame)
+
+    async def write(self, align, font, text):
+        await self.__initialize()
+
+        await self.__show_frame(await self.render(align, font, text))
 
 
 
@@ -166,7 +358,7 @@ class OLED:
     async def update(self, value, label):
         await self.__initialize()
 
-        await self.__show(_gen_image(Writ(
+        await self.__show_frame(await self.__render(Writ(
             size=self.size,
             align=WritAlign.TOP,
             font=self.value_font_filename,
@@ -175,7 +367,7 @@ class OLED:
 
         await sleep_until_interval(1/2)
 
-        await self.__show(_gen_image(Writ(
+        await self.__show_frame(await self.__render(Writ(
             size=self.size,
             align=WritAlign.BOTTOM,
             font=self.label_font_filename,
@@ -0,0 +1,209 @@
+import contextlib, json, mmap, os, struct
+from argparse import ArgumentParser
+
+import glyphs
+import oled
+from oled import Writ, WritAlign
+
+# Everything the OLEDs need at startup, worked out once and kept on disk.
+#
+# systemd gives us four seconds to start, and without this, the first
+# frame on each OLED means taking fonts apart into glyph atlases and
+# rendering labels that are the same every time. So a cache file holds
+# the atlases of the fonts we use and the frames that never change
+# (already in the SSD1306's layout), and at startup it's mmapped and
+# handed to glyphs.preload() and oled.preload(). Frames are used straight
+# out of the mapping; glyphs are rebuilt from it, which is a lot quicker
+# than from the font.
+#
+# The file is rebuilt whenever a font in it changes, or something's
+# asked for that it doesn't have.
+#
+# Layout: MAGIC, then the version and the length of the index (two
+# little-endian uint32s), then the index (JSON), then the data the index
+# points into.
+
+
+class Config:
+    MAGIC = b"GPSCLKRC"
+    VERSION = 1
+    HEADER = struct.Struct('<II')
+    # dx, left, number of columns, then the mask and each column
+    GLYPH = struct.Struct('<hhH')
+    COLUMN = struct.Struct('<Q')
+
+
+def _stamp(filename):
+    stat = os.stat(filename)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _writ_key(writ):
+    return [list(writ.size), writ.align.value, writ.font, list(writ.text)]
+
+
+def _writ(key):
+    size, align, font, text = key
+    return Writ(size=tuple(size), align=WritAlign(align), font=font, text=tuple(text))
+
+
+def _pack_atlas(atlas):
+    data = bytearray()
+    for glyph in atlas.glyphs:
+        data += Config.GLYPH.pack(glyph.dx, glyph.left, len(glyph.columns))
+        data += Config.COLUMN.pack(glyph.mask)
+        for column in glyph.columns:
+            data += Config.COLUMN.pack(column)
+    return data
+
+
+def _unpack_atlas(data, baseline, height):
+    glyph_list = list()
+    at = 0
+    for _ in range(256):
+        dx, left, count = Config.GLYPH.unpack_from(data, at)
+        at += Config.GLYPH.size
+        mask, *columns = (
+            value for value, in Config.COLUMN.iter_unpack(
+                data[at:at + (count + 1) * Config.COLUMN.size]
+            )
+        )
+        at += (count + 1) * Config.COLUMN.size
+        glyph_list.append(glyphs.Glyph(dx, left, columns, mask))
+    return glyphs.Atlas.restore(baseline, height, glyph_list)
+
+
+def build(path, fonts, writs):
+    r"""Write a new cache file.
+
+    :param fonts: filenames of the fonts to keep atlases of
+    :param writs: the Writs to keep frames of
+    """
+    index = dict(fonts=dict(), frames=list())
+    data = bytearray()
+
+    for font in fonts:
+        atlas = glyphs.load(font)
+        packed = _pack_atlas(atlas)
+        index['fonts'][font] = dict(
+            stamp=_stamp(font),
+            baseline=atlas.baseline,
+            height=atlas.height,
+            offset=len(data),
+            length=len(packed),
+        )
+        data += packed
+
+    for writ in writs:
+        frame = oled._gen_frame(writ)
+        index['frames'].append([_writ_key(writ), len(data), len(frame)])
+        data += frame
+
+    encoded = json.dumps(index).encode()
+    # offsets in the index are from the start of the data
+    header = Config.MAGIC + Config.HEADER.pack(Config.VERSION, len(encoded))
+    temporary = f"{path}.{os.getpid()}"
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(header + encoded + data)
+        # so that nobody ever maps half a cache
+        os.replace(temporary, path)
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.remove(temporary)
+        raise
+
+
+class RenderCache:
+    r"""A cache file, mapped into memory.
+
+    :raise ValueError: if it isn't a cache file (of this version)
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        magic = len(Config.MAGIC)
+        if bytes(view[:magic]) != Config.MAGIC:
+            raise ValueError(f"not a render cache: {path}")
+        version, length = Config.HEADER.unpack_from(view, magic)
+        if version != Config.VERSION:
+            raise ValueError(f"render cache version {version}, not {Config.VERSION}")
+        start = magic + Config.HEADER.size
+        self.index = json.loads(bytes(view[start:start + length]))
+        self.data = view[start + length:]
+
+    def fresh(self, fonts=(), writs=()):
+        r"""Whether we've got all of these, and they're up to date."""
+        cached = self.index['fonts']
+        for font in fonts:
+            if font not in cached or cached[font]['stamp'] != _stamp(font):
+                return False
+        have = {_writ(key) for key, _, _ in self.index['frames']}
+        return all(writ in have for writ in writs)
+
+    def install(self):
+        r"""Hand everything over to glyphs and oled."""
+        data = self.data
+        for font, entry in self.index['fonts'].items():
+            offset, length = entry['offset'], entry['length']
+            glyphs.preload(font, _unpack_atlas(
+                data[offset:offset + length], entry['baseline'], entry['height']
+            ))
+        for key, offset, length in self.index['frames']:
+            oled.preload(_writ(key), data[offset:offset + length])
+
+
+def load(path, fonts=(), writs=()):
+    r"""Load a cache file, building it first if it's missing or stale.
+
+    :param fonts: filenames of the fonts we'll want atlases of
+    :param writs: the Writs we'll want frames of
+    :return: the RenderCache (already installed), or None if there isn't
+        one and it can't be built (e.g., somewhere we can't write)
+    """
+    try:
+        cache = RenderCache(path)
+        if cache.fresh(fonts, writs):
+            cache.install()
+            return cache
+        print("render cache: out of date; rebuilding")
+    except (OSError, ValueError) as e:
+        print(f"render cache: {e}; rebuilding")
+    try:
+        build(path, fonts, writs)
+        cache = RenderCache(path)
+    except (OSError, ValueError) as e:
+        print(f"render cache: {e}; going without")
+        return None
+    cache.install()
+    return cache
+
+
+def install(path):
+    r"""Use a cache file if there's a good one, and never mind if not.
+
+    For worker processes, which shouldn't all be racing to rebuild it.
+    """
+    try:
+        RenderCache(path).install()
+    except (OSError, ValueError):
+        pass
+
+
+def main():
+    argyle = ArgumentParser(description="build or check a render cache")
+    argyle.add_argument('cache', help="the cache file")
+    argyle.add_argument('fonts', nargs='*', help="fonts to keep atlases of")
+    args = argyle.parse_args()
+
+    if args.fonts:
+        build(args.cache, args.fonts, ())
+    cache = RenderCache(args.cache)
+    for font, entry in cache.index['fonts'].items():
+        print(f"{font}: {entry['length']} bytes of glyphs")
+    print(f"{len(cache.index['frames'])} frames, {len(cache.map)} bytes in all")
+
+
+if __name__ == '__main__':
+    main()
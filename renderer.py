@@ -0,0 +1,124 @@
+import asyncio, multiprocessing, signal
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from oled import _gen_frame
+
+# Rendering OLED frames, somewhere other than the event loop's thread.
+#
+# Even from glyph atlases, a frame is a fair bit of Python, and (being
+# Python) it holds the GIL the whole time, which is time the clock might
+# have wanted. So frames are rendered in a small pool of worker processes,
+# and handed back as finished page-format framebuffers.
+#
+# Better yet, they're rendered before anyone asks: whenever there's news
+# from gpsd, whoever knows what the OLEDs are going to show can prefetch()
+# it, and by the time the OLED's cycle gets around to it, the frame's
+# already waiting.
+#
+# If a worker dies (the OOM killer, say), the pool is no good any more, so
+# it's replaced with a new one; anything that was rendering when it died
+# gets rendered on the loop after all, this once.
+
+
+class Config:
+    WORKERS = 1
+    # how many finished (or in-progress) frames to hang on to
+    CACHE = 64
+
+
+def _initialize(initializer, initargs):
+    # SIGUSR1 is for the parent (a report), but it may come our way too,
+    #  and by default it'd kill us
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+class Renderer:
+    r"""A pool of processes rendering Writs into frames.
+
+    :param workers: how many processes
+    :param cache: how many frames to remember
+    :param initializer: called (with initargs) in each worker, first
+    """
+    def __init__(self, workers=Config.WORKERS, cache=Config.CACHE,
+            initializer=None, initargs=()):
+        self.workers = workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.pool = self._pool()
+        self.cache = cache
+        self.frames = OrderedDict()  # Writ -> asyncio future of its frame
+        self.hits = 0  # asked for, and already rendered
+        self.waits = 0  # asked for, and still rendering
+        self.misses = 0  # asked for, and not even started
+        self.restarts = 0  # pools replaced, after a worker died
+
+    def _pool(self):
+        # spawn, not fork: we're likely forking from inside an event loop
+        return ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_initialize, initargs=(self.initializer, self.initargs),
+        )
+
+    def _submit(self, writ):
+        try:
+            return self.pool.submit(_gen_frame, writ)
+        except BrokenProcessPool:
+            print("renderer: a worker died; starting new ones")
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = self._pool()
+            self.restarts += 1
+            return self.pool.submit(_gen_frame, writ)
+
+    def prefetch(self, writ):
+        r"""Start rendering a Writ, unless it's already been started.
+
+        :return: a future of the frame
+        """
+        future = self.frames.get(writ)
+        if future is not None:
+            self.frames.move_to_end(writ)
+            return future
+
+        future = asyncio.wrap_future(self._submit(writ))
+        future.add_done_callback(lambda f: self._done(writ, f))
+        self.frames[writ] = future
+        while len(self.frames) > self.cache:
+            self.frames.popitem(last=False)
+        return future
+
+    def _done(self, writ, future):
+        # don't remember failures; maybe it'll work next time
+        if future.cancelled() or future.exception() is not None:
+            if self.frames.get(writ) is future:
+                del self.frames[writ]
+
+    async def render(self, writ):
+        r"""The frame for a Writ, rendering it if need be."""
+        future = self.frames.get(writ)
+        if future is None:
+            self.misses += 1
+        elif future.done():
+            self.hits += 1
+        else:
+            self.waits += 1
+        # (shielded: others may want the same frame)
+        try:
+            return await asyncio.shield(self.prefetch(writ))
+        except BrokenProcessPool:
+            # its worker died while it was rendering; the next prefetch()
+            #  gets a new pool, but this one we'll just do ourselves
+            return _gen_frame(writ)
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def __str__(self):
+        return (
+            f"{self.hits} ready, {self.waits} waited for,"
+            f" {self.misses} not started; {len(self.frames)} cached,"
+            f" {self.restarts} restarts"
+        )
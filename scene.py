@@ -0,0 +1,127 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from oled import Writ, WritAlign
+
+# What an OLED shows, as a timeline rather than as code.
+#
+# A Scene is a cycle (every four seconds, say) of Shots, each shown at
+# some point in the cycle: a label, then the value, then nothing. Every
+# frame of the next cycle gets rendered before the cycle starts, into a
+# back buffer; at the start of the cycle, back and front are swapped, and
+# each Shot's job is then just to put an already-rendered frame on the
+# display, at the scheduler's precise time.
+
+
+class Config:
+    # how long before the start of each cycle to render its frames
+    LEAD = 0.5
+
+
+@dataclass(frozen=True)
+class Shot:
+    r"""One frame of a Scene.
+
+    Either static (align, font and text, or none of them for a blank
+    screen), or from a value function, called before each cycle.
+
+    :param at: seconds into the cycle to show it
+    :param value: returns (font, text), or None to leave whatever's on
+        the display as it is
+    """
+    at: float
+    align: Optional[str] = None
+    font: Optional[str] = None
+    text: Optional[Tuple[str, ...]] = None
+    value: Optional[Callable] = None
+
+
+class Scene:
+    r"""A timeline of frames on one OLED, over and over.
+
+    :param oled: the OLED to show them on
+    :param shots: the Shots, in any order
+    :param period: seconds in a cycle
+    :param offset: seconds past each whole period the cycle starts
+    :param name: what to call it, e.g., in the scheduler's report
+    """
+    def __init__(self, oled, shots, period=4, offset=0, lead=Config.LEAD, name="scene"):
+        self.oled = oled
+        self.shots = sorted(shots, key=lambda shot: shot.at)
+        self.period = period
+        self.offset = offset
+        self.lead = lead
+        self.name = name
+        self.front = None  # frames for this cycle
+        self.back = None  # frames for the next
+        self.jobs = list()
+        self.preparing = None
+
+    def writs(self):
+        r"""The Writs of the Shots that are the same every cycle."""
+        return [
+            Writ(
+                size=self.oled.size,
+                align=WritAlign(shot.align),
+                font=shot.font,
+                text=shot.text,
+            )
+            for shot in self.shots
+            if shot.value is None and shot.align is not None
+        ]
+
+    def start(self, scheduler):
+        r"""Schedule the Scene's jobs (and get its first cycle ready)."""
+        every = scheduler.every
+        job = every(self.period, self.prepare, self.offset - self.lead)
+        job.name = f"{self.name}.prepare"
+        self.jobs.append(job)
+        for index, shot in enumerate(self.shots):
+            job = every(
+                self.period, lambda index=index: self.show(index),
+                self.offset + shot.at,
+            )
+            job.name = f"{self.name}[{shot.at}]"
+            self.jobs.append(job)
+        self.preparing = asyncio.create_task(self.prepare(), name=f"{self.name}.prepare")
+        self.preparing.add_done_callback(self._prepared)
+
+    def _prepared(self, task):
+        # (nobody awaits it, so this is the only place a failure shows)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"{self.name}: first cycle not prepared: {task.exception()!r}")
+
+    def stop(self):
+        for job in self.jobs:
+            job.cancel()
+        self.jobs.clear()
+        if self.preparing is not None:
+            self.preparing.cancel()
+            self.preparing = None
+
+    async def render(self, shot):
+        oled = self.oled
+        if shot.value is not None:
+            value = shot.value()
+            if value is None:
+                return None
+            font, text = value
+            return await oled.render(shot.align, font, text)
+        if shot.align is None:
+            return oled.blank()
+        return await oled.render(shot.align, shot.font, shot.text)
+
+    async def prepare(self):
+        r"""Render the next cycle's frames, into the back buffer."""
+        self.back = await asyncio.gather(*map(self.render, self.shots))
+
+    async def show(self, index):
+        if index == 0 and self.back is not None:
+            self.front, self.back = self.back, None
+        if self.front is None:
+            # nothing's been rendered yet (it's the very first cycle)
+            return
+        frame = self.front[index]
+        if frame is not None:
+            await self.oled.show_frame(frame)
@@ -1,5 +1,12 @@
 import asyncio
 import time
+import heapq
+import weakref
+from enum import Enum
+from itertools import count
+from math import inf, sqrt
+
+from timerfd import realtime_timer
 
 # given a clock time, convert to monotonic loop time
 async def _time_time_to_loop_time(when):
@@ -23,24 +30,366 @@ def _next_interval(t, interval):
     """
     return ((t + interval) // interval) * interval
 
-async def run_every(interval, what):
+def run_every(interval, what, offset=0, **kwargs):
     r"""Given an interval in seconds, execute at the top of that interval.
 
     Especially: if the interval is a fraction of a second, execute
     at the beginning of the second, then at each equal fraction thereof.
+
+    All such jobs share one timer heap (per event loop), so that jobs
+    falling due at the same moment run in a single wakeup.
+
+    :param interval: an interval, in seconds
+    :param what: a callable; if it returns an awaitable, that's run as a
+        task, and the job won't run again until it's done
+    :param offset: seconds past the top of the interval to run at
+    :return: a Job, which can be cancelled
+    """
+    scheduler = Scheduler.shared()
+    scheduler.start()
+    return scheduler.every(interval, what, offset, **kwargs)
+
+class Lateness:
+    r"""Running statistics on how late things happen, in seconds.
+
+    (Negative lateness is earliness.)
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.min = inf
+        self.max = -inf
+        self._m2 = 0.0
+
+    def record(self, late):
+        # Welford's algorithm, so we needn't keep every sample around
+        self.count += 1
+        delta = late - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (late - self.mean)
+        if late < self.min:
+            self.min = late
+        if late > self.max:
+            self.max = late
+
+    @property
+    def stdev(self):
+        if self.count < 2:
+            return 0.0
+        return sqrt(self._m2 / (self.count - 1))
+
+    def __str__(self):
+        if not self.count:
+            return "n=0"
+        usec = 1e6
+        return (
+            f"n={self.count}"
+            f" mean={self.mean*usec:.1f}\xB5s"
+            f" sd={self.stdev*usec:.1f}\xB5s"
+            f" min={self.min*usec:.1f}\xB5s"
+            f" max={self.max*usec:.1f}\xB5s"
+        )
+
+
+class PrecisionSleeper:
+    r"""Sleep until a deadline, and then actually be there on time.
+
+    ``asyncio.sleep()`` wakes us up whenever the event loop gets around to
+    it, which is usually a millisecond or few after we asked, and never
+    the same amount twice. So when being precise, sleep until ``guard``
+    seconds before the deadline, and then spin on ``perf_counter_ns()``
+    for the rest of the way.
+
+    The guard tunes itself: it tracks how far past the early wakeup the
+    event loop tends to overshoot, and how much that varies, and keeps
+    just enough slack to cover it.
+
+    Either way, ``lateness`` keeps statistics on when we actually woke up
+    relative to the deadline, so that the two approaches can be compared.
     """
-    # when does the next interval begin?
-    next_top = _next_interval(time.time(), interval)
-    # we probably ought to account for the possibility that the next
-    #   interval has already passed
-    pass
+    def __init__(self,
+            precise=True,
+            guard=0.002,
+            min_guard=0.0005,
+            max_guard=0.010,
+            adapt=1/64,
+        ):
+        self.precise = precise
+        self.guard = guard
+        self.min_guard = min_guard
+        self.max_guard = max_guard
+        self.adapt = adapt
+
+        self.lateness = Lateness()
+
+        # smoothed overshoot of the early wakeup, and its smoothed deviation
+        self._overshoot = guard / 2
+        self._jitter = guard / 8
+
+    def _tune(self, overshoot):
+        self._overshoot += self.adapt * (overshoot - self._overshoot)
+        self._jitter += self.adapt * (abs(overshoot - self._overshoot) - self._jitter)
+        self.guard = min(
+            max(self._overshoot + 4 * self._jitter, self.min_guard),
+            self.max_guard
+        )
+
+    def early(self, when):
+        r"""When to stop sleeping in order to arrive on time."""
+        return when - self.guard if self.precise else when
+
+    def arrive(self, when):
+        r"""Having slept until ``early(when)``, get the rest of the way."""
+        if self.precise:
+            self._tune(time.time() - (when - self.guard))
+
+            # and the rest of the way on foot
+            until = time.perf_counter_ns() + int((when - time.time()) * 1e9)
+            while time.perf_counter_ns() < until:
+                pass
+
+        self.lateness.record(time.time() - when)
+
+    async def sleep_until(self, when, result=None):
+        r"""Sleep until a time.
+
+        :param when: a time in seconds, as from time.time()
+        :param result: returned when done sleeping
+        :return: result
+        """
+        await asyncio.sleep(self.early(when) - time.time())
+        self.arrive(when)
+        return result
+
+
+class Policy(Enum):
+    r"""What a periodic job does when it's fallen behind."""
+    SKIP = "skip"          # give up on the intervals we missed
+    CATCH_UP = "catch_up"  # run once for each of them, as soon as we can
+
+
+class Job:
+    def __init__(self, scheduler, interval, what, offset, policy, sleeper, priority):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.what = what
+        self.offset = offset
+        self.policy = policy
+        self.sleeper = sleeper
+        self.priority = priority
+        self.name = getattr(what, '__qualname__', repr(what))
+
+        self.when = None         # when we're next due
+        self.task = None         # if we returned an awaitable, its task
+        self.cancelled = False
+
+        self.runs = 0
+        self.skipped = 0         # intervals given up on
+        self.overruns = 0        # times we were due but still running
+
+    def cancel(self):
+        self.cancelled = True
+        if self.task is not None:
+            self.task.cancel()
+
+    def next_after(self, t):
+        return _next_interval(t - self.offset, self.interval) + self.offset
+
+    def reschedule(self, now):
+        if self.policy is Policy.CATCH_UP:
+            self.when += self.interval
+            return
+        # (from halfway along, so rounding can't land us right back here)
+        when = self.next_after(self.when + self.interval / 2)
+        if when <= now:
+            when = self.next_after(now)
+            self.skipped += round((when - self.when) / self.interval) - 1
+        self.when = when
+
+
+class Scheduler:
+    r"""Periodic jobs, all kept in one timer heap.
+
+    Rather than have every periodic task sleep on its own (and wake up on
+    its own, even when several of them are due at the same moment), keep
+    them all in a heap, ordered by when they're next due, and sleep only
+    until the soonest. Everything due by then runs in the same wakeup.
+
+    A job may have a PrecisionSleeper, in which case the scheduler sleeps
+    only until the sleeper's early wakeup, and lets it do the rest.
+
+    Deadlines are absolute wall-clock times, kept by a timerfd where
+    there is one; if the clock is stepped, every job is rescheduled from
+    the new time and the ``on_step`` callbacks are called.
+    """
+    # jobs due within this many seconds of now run now (or within a
+    #  quarter of their interval, if that's less: the clock's FOURTHS are
+    #  only 0.28ms apart)
+    SLOP = 0.0005
+
+    _shared = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def shared(cls):
+        r"""The scheduler for the running event loop."""
+        loop = asyncio.get_running_loop()
+        if loop not in cls._shared:
+            cls._shared[loop] = cls()
+        return cls._shared[loop]
+
+    def __init__(self, timer=None):
+        self.heap = []
+        self.task = None
+        self.wakeups = 0
+        self.timer = realtime_timer(self._stepped) if timer is None else timer
+        self.on_step = []
+        self._sequence = count()
+        self._wakeup = None
+        self._failed = None
+        self._step = False
+
+    def every(self, interval, what, offset=0,
+            policy=Policy.SKIP, sleeper=None, priority=0):
+        r"""Run something periodically; see run_every().
+
+        :param policy: what to do after falling behind
+        :param sleeper: a PrecisionSleeper, for jobs that must be on time
+        :param priority: among jobs due at once, lower runs first
+        :return: a Job
+        """
+        job = Job(self, interval, what, offset, policy, sleeper, priority)
+        job.when = job.next_after(time.time())
+        self._push(job)
+        self._poke()
+        return job
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run(), name="scheduler")
+        return self.task
+
+    def _push(self, job):
+        heapq.heappush(self.heap, (job.when, job.priority, next(self._sequence), job))
+
+    def _stepped(self):
+        self._step = True
+        self._poke()
+
+    def _reschedule(self):
+        now = time.time()
+        jobs = [job for _, _, _, job in self.heap if not job.cancelled]
+        self.heap = []
+        for job in jobs:
+            job.when = job.next_after(now)
+            self._push(job)
+
+    def _poke(self, value=False):
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(value)
+
+    async def _wait(self, until):
+        r"""Sleep until a time, or until something changes.
+
+        :return: True if it's time; False if we were woken up early
+        """
+        loop = asyncio.get_running_loop()
+        self._wakeup = loop.create_future()
+        handle = None
+        if until is not None:
+            handle = self.timer.call_at(until, lambda: self._poke(True))
+        try:
+            return await self._wakeup
+        finally:
+            self._wakeup = None
+            if handle is not None:
+                handle.cancel()
+
+    def _done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self._failed = task.exception()
+            self._poke()
+
+    def _run(self, job):
+        if job.task is not None:
+            if not job.task.done():
+                job.overruns += 1
+                return
+            job.task = None
+
+        job.runs += 1
+        result = job.what()
+        if asyncio.iscoroutine(result):
+            job.task = asyncio.create_task(result, name=job.name)
+        elif asyncio.isfuture(result):
+            job.task = result
+        if job.task is not None:
+            job.task.add_done_callback(self._done)
+
+    async def run(self):
+        try:
+            while True:
+                if self._failed is not None:
+                    raise self._failed
+                if self._step:
+                    self._step = False
+                    self._reschedule()
+                    for callback in self.on_step:
+                        callback()
+
+                while self.heap and self.heap[0][-1].cancelled:
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    await self._wait(None)
+                    continue
+
+                when, _, _, job = self.heap[0]
+                sleeper = job.sleeper
+                if not await self._wait(sleeper.early(when) if sleeper else when):
+                    # something changed; start over
+                    continue
+                if sleeper is not None:
+                    sleeper.arrive(when)
+                self.wakeups += 1
+
+                now = time.time()
+                due = list()
+                while self.heap:
+                    when, _, _, job = self.heap[0]
+                    if when > now + min(self.SLOP, job.interval / 4):
+                        break
+                    heapq.heappop(self.heap)
+                    if not job.cancelled:
+                        due.append(job)
+                # (only put back once they've all been taken, so that a
+                #  job that's due again within the slop isn't run twice)
+                for job in due:
+                    self._run(job)
+                    job.reschedule(now)
+                    self._push(job)
+        finally:
+            for _, _, _, job in self.heap:
+                if job.task is not None:
+                    job.task.cancel()
+
+    def __str__(self):
+        jobs = sorted(
+            (job for _, _, _, job in self.heap if not job.cancelled),
+            key=lambda job: job.name
+        )
+        return f"{self.wakeups} wakeups, {self.timer.steps} clock steps; " + ", ".join(
+            f"{job.name}: {job.runs} runs, {job.skipped} skipped, {job.overruns} overruns"
+            for job in jobs
+        )
 
 # lame example, but can't think of anything better
 async def main():
     await run_at(time.time()+5, lambda: print(f"hello at {time.asctime()}"))
+    run_every(1, lambda: print(f"every second at {time.time()}"))
+    run_every(2, lambda: print(f"every other second at {time.time()}"), 0.5)
     for s in range(20):
         print(s/2)
         await asyncio.sleep(0.5)
+    print(Scheduler.shared())
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,474 @@
+import time, threading
+from collections import deque, namedtuple, defaultdict
+
+# for main()
+from argparse import ArgumentParser
+import asyncio, os
+
+# In-memory stand-ins for the hardware, so that the clock and the OLEDs
+# can be run (and timed, and checked) on a machine that has none of it.
+#
+# SimI2C looks enough like busio.I2C that the Adafruit drivers (and
+# therefore Clock and OLED) will happily talk to it. It hands each write
+# to whichever simulated device lives at that address, which decodes it
+# and updates its own idea of its RAM, and it records every transaction
+# along with how long it would have taken on a real bus.
+#
+# SimGPIO does the same for digitalio pins, for the LEDs.
+
+Transaction = namedtuple('Transaction', (
+    'time',      # when it started, from time.perf_counter_ns()
+    'address',   # I2C address, or GPIO pin
+    'nbytes',    # bytes on the wire (not counting the address byte)
+    'duration',  # nanoseconds it would have taken
+    'what',      # what the device made of it
+))
+
+
+class SimI2C:
+    r"""A simulated I2C bus.
+
+    :param frequency: bus speed, in Hz
+    :param latency: extra time per transaction, in seconds, for all the
+        layers between Python and the wire
+    :param realtime: actually take as long as a real bus would
+    :param history: how many transactions to remember
+    """
+    def __init__(self, frequency=400_000, latency=0.0, realtime=False, history=100_000):
+        self.frequency = frequency
+        self.latency = latency
+        self.realtime = realtime
+        self.devices = dict()
+        self.transactions = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def attach(self, device):
+        self.devices[device.address] = device
+        return device
+
+    def duration(self, nbytes):
+        r"""How long a transaction would take, in nanoseconds."""
+        # 9 bits a byte (8 plus ACK), plus the address byte, plus a start
+        #  and a stop
+        bits = (nbytes + 1) * 9 + 2
+        return int((bits / self.frequency + self.latency) * 1e9)
+
+    def _transact(self, address, nbytes, what):
+        device = self.devices.get(address)
+        if device is None:
+            # what busio would do, and what I2CDevice's probe expects
+            raise OSError(121, "Remote I/O error")
+
+        start = time.perf_counter_ns()
+        duration = self.duration(nbytes)
+        result = what(device)
+        if self.realtime:
+            until = start + duration
+            while time.perf_counter_ns() < until:
+                pass
+
+        description = result if isinstance(result, str) else ''
+        self.transactions.append(Transaction(start, address, nbytes, duration, description))
+        return result
+
+    def stats(self):
+        r"""Transactions, bytes and bus time (in nanoseconds), per address."""
+        stats = defaultdict(lambda: dict(transactions=0, nbytes=0, duration=0))
+        for t in self.transactions:
+            s = stats[t.address]
+            s['transactions'] += 1
+            s['nbytes'] += t.nbytes
+            s['duration'] += t.duration
+        return dict(stats)
+
+    # everything from here on down is the busio.I2C interface
+
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def deinit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        data = bytes(buffer[start:end])
+        return self._transact(address, len(data), lambda d: d.write(data))
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        def read(device):
+            buffer[start:end] = device.read(end - start)
+            return f"read {end - start}"
+        return self._transact(address, end - start, read)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+            out_start=0, out_end=None, in_start=0, in_end=None):
+        self.writeto(address, buffer_out, start=out_start, end=out_end)
+        self.readfrom_into(address, buffer_in, start=in_start, end=in_end)
+
+
+class SimHT16K33:
+    r"""A simulated HT16K33 LED driver, as on the seven-segment backpacks."""
+    RAM_SIZE = 16
+    POSITIONS = (0, 2, 6, 8)
+    COLON = (4, 0b00000010)
+    DOT = 0b10000000
+
+    def __init__(self, address=0x70):
+        self.address = address
+        self.ram = bytearray(self.RAM_SIZE)
+        self.oscillator = False
+        self.display = False
+        self.blink = 0
+        self.brightness = 15
+
+    def write(self, data):
+        if not data:
+            return "probe"
+        command = data[0]
+        kind = command & 0xF0
+        if kind == 0x00:
+            # display data address pointer, followed by data
+            start = command & 0x0F
+            for i, byte in enumerate(data[1:]):
+                self.ram[(start + i) % self.RAM_SIZE] = byte
+            return f"ram[{start}:{start + len(data) - 1}]"
+        if kind == 0x20:
+            self.oscillator = bool(command & 0x01)
+            return f"oscillator {'on' if self.oscillator else 'off'}"
+        if kind == 0x80:
+            self.display = bool(command & 0x01)
+            self.blink = (command >> 1) & 0x03
+            return f"display {'on' if self.display else 'off'} blink {self.blink}"
+        if kind == 0xE0:
+            self.brightness = command & 0x0F
+            return f"brightness {self.brightness}"
+        return f"unknown command {command:#04x}"
+
+    def read(self, nbytes):
+        return bytes(self.ram[:nbytes])
+
+    def text(self, bits):
+        r"""What the display shows, e.g. '21:45.36.19' (well, half of it).
+
+        :param bits: segment bit patterns for 0 through 9
+        """
+        digits = {b: str(d) for d, b in enumerate(bits)}
+        s = ''
+        for i, position in enumerate(self.POSITIONS):
+            byte = self.ram[position]
+            s += digits.get(byte & ~self.DOT, '?' if byte & ~self.DOT else ' ')
+            if byte & self.DOT:
+                s += '.'
+            if i == 1 and self.ram[self.COLON[0]] & self.COLON[1]:
+                s += ':'
+        return s
+
+
+class SimSSD1306:
+    r"""A simulated SSD1306 OLED controller.
+
+    Understands enough of the command set to follow the addressing
+    commands and keep track of what's in display RAM.
+    """
+    PAGES = 8
+    COLUMNS = 128
+
+    # how many argument bytes each multi-byte command takes
+    ARGUMENTS = {
+        0x20: 1,  # memory addressing mode
+        0x21: 2,  # column address
+        0x22: 2,  # page address
+        0x26: 6,  # right horizontal scroll
+        0x27: 6,  # left horizontal scroll
+        0x29: 5,  # vertical and right horizontal scroll
+        0x2A: 5,  # vertical and left horizontal scroll
+        0x81: 1,  # contrast
+        0x8D: 1,  # charge pump
+        0xA3: 2,  # vertical scroll area
+        0xA8: 1,  # multiplex ratio
+        0xAD: 1,  # internal IREF
+        0xD3: 1,  # display offset
+        0xD5: 1,  # clock divide
+        0xD9: 1,  # pre-charge
+        0xDA: 1,  # COM pins
+        0xDB: 1,  # VCOMH deselect
+    }
+
+    HORIZONTAL, VERTICAL, PAGE = range(3)
+
+    def __init__(self, address=0x3c, size=(128, 64)):
+        self.address = address
+        self.size = size
+        self.ram = bytearray(self.PAGES * self.COLUMNS)
+        self.display = False
+        self.contrast = 0x7F
+        self.mode = self.PAGE
+        self.columns = (0, self.COLUMNS - 1)
+        self.pages = (0, self.PAGES - 1)
+        self.column = 0
+        self.page = 0
+        self.scroll = None
+        self.scrolling = False
+        self._pending = []
+
+    def write(self, data):
+        if not data:
+            return "probe"
+
+        commands = 0
+        written = 0
+        i = 0
+        while i < len(data):
+            control = data[i]
+            i += 1
+            continuation = control & 0x80
+            is_data = control & 0x40
+            chunk = data[i:i+1] if continuation else data[i:]
+            i += len(chunk)
+            if is_data:
+                self._data(chunk)
+                written += len(chunk)
+            else:
+                for byte in chunk:
+                    self._command(byte)
+                commands += len(chunk)
+
+        what = []
+        if commands:
+            what.append(f"{commands} command bytes")
+        if written:
+            what.append(f"{written} data bytes")
+        return ", ".join(what)
+
+    def read(self, nbytes):
+        # status byte: display on/off
+        return bytes((0x00 if self.display else 0x40,) * nbytes)
+
+    def _command(self, byte):
+        if self._pending:
+            self._pending.append(byte)
+        elif byte in self.ARGUMENTS:
+            self._pending = [byte]
+        else:
+            self._execute(byte, ())
+            return
+
+        command, *args = self._pending
+        if len(args) == self.ARGUMENTS[command]:
+            self._pending = []
+            self._execute(command, args)
+
+    def _execute(self, command, args):
+        if command == 0x20:
+            self.mode = args[0] & 0x03
+        elif command == 0x21:
+            self.columns = (args[0] & 0x7F, args[1] & 0x7F)
+            self.column = self.columns[0]
+        elif command == 0x22:
+            self.pages = (args[0] & 0x07, args[1] & 0x07)
+            self.page = self.pages[0]
+        elif command in (0x26, 0x27, 0x29, 0x2A):
+            self.scroll = (command, tuple(args))
+        elif command == 0x2E:
+            self.scrolling = False
+        elif command == 0x2F:
+            self.scrolling = True
+        elif command == 0x81:
+            self.contrast = args[0]
+        elif command in (0xAE, 0xAF):
+            self.display = bool(command & 0x01)
+        elif 0xB0 <= command <= 0xB7:
+            self.page = command & 0x07
+        elif command <= 0x0F:
+            self.column = (self.column & 0xF0) | command
+        elif command <= 0x1F:
+            self.column = (self.column & 0x0F) | ((command & 0x0F) << 4)
+        # anything else is configuration we needn't keep track of
+
+    def _data(self, data):
+        first_column, last_column = self.columns
+        first_page, last_page = self.pages
+        for byte in data:
+            self.ram[self.page * self.COLUMNS + self.column] = byte
+            if self.mode == self.HORIZONTAL:
+                self.column += 1
+                if self.column > last_column:
+                    self.column = first_column
+                    self.page = first_page if self.page >= last_page else self.page + 1
+            elif self.mode == self.VERTICAL:
+                self.page += 1
+                if self.page > last_page:
+                    self.page = first_page
+                    self.column = first_column if self.column >= last_column else self.column + 1
+            elif self.column < self.COLUMNS - 1:
+                self.column += 1
+
+    def framebuffer(self):
+        r"""The visible part of display RAM, a page at a time."""
+        width, height = self.size
+        offset = (self.COLUMNS - width) // 2
+        return b''.join(
+            self.ram[page * self.COLUMNS + offset : page * self.COLUMNS + offset + width]
+            for page in range(height // 8)
+        )
+
+
+class SimGPIO:
+    r"""Simulated GPIO pins, which record every change of value.
+
+    ``SimGPIO().DigitalInOut`` can stand in for ``digitalio.DigitalInOut``.
+
+    :param latency: how long each change of value takes, in seconds
+    :param realtime: actually take that long
+    :param history: how many changes to remember
+    """
+    def __init__(self, latency=0.0, realtime=False, history=100_000):
+        self.latency = latency
+        self.realtime = realtime
+        self.transactions = deque(maxlen=history)
+        self.values = dict()
+
+    def DigitalInOut(self, pin):
+        return SimPin(self, pin)
+
+    def _set(self, pin, value):
+        start = time.perf_counter_ns()
+        duration = int(self.latency * 1e9)
+        self.values[pin] = value
+        if self.realtime:
+            until = start + duration
+            while time.perf_counter_ns() < until:
+                pass
+        self.transactions.append(Transaction(start, pin, 0, duration, str(value)))
+
+
+class SimPin:
+    def __init__(self, gpio, pin):
+        self.gpio = gpio
+        self.pin = pin
+        self.direction = None
+        self.pull = None
+        self._value = False
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = bool(value)
+        self.gpio._set(self.pin, self._value)
+
+    def switch_to_output(self, value=False, drive_mode=None):
+        self.direction = 'output'
+        self.value = value
+
+    def switch_to_input(self, pull=None):
+        self.direction = 'input'
+        self.pull = pull
+
+    def deinit(self):
+        pass
+
+
+def main():
+    from clock import Clock, Config as ClockConfig
+    from oled import OLED
+    from led import LED
+    from i2c_arbiter import I2CArbiter
+
+    argyle = ArgumentParser(description="run the displays against simulated hardware")
+    argyle.add_argument('-s', '--seconds',
+        type=float, default=2,
+        help="how long to run the clock"
+    )
+    argyle.add_argument('-f', '--frequency',
+        type=int, default=400_000,
+        help="I2C bus speed, in Hz"
+    )
+    argyle.add_argument('-l', '--latency',
+        type=float, default=50e-6,
+        help="per-transaction overhead, in seconds"
+    )
+    argyle.add_argument('-r', '--realtime',
+        action='store_true',
+        help="take as long as the real bus would"
+    )
+    argyle.add_argument('-a', '--arbiter',
+        action='store_true',
+        help="go through an I2CArbiter"
+    )
+    args = argyle.parse_args()
+
+    i2c = SimI2C(args.frequency, args.latency, args.realtime)
+    left = i2c.attach(SimHT16K33(0x70))
+    right = i2c.attach(SimHT16K33(0x71))
+    i2c.attach(SimSSD1306(0x3c, (128, 32)))
+    big = i2c.attach(SimSSD1306(0x3d, (128, 64)))
+    gpio = SimGPIO(latency=20e-6, realtime=args.realtime)
+    arbiter = I2CArbiter(i2c) if args.arbiter else None
+
+    def report(what, seconds):
+        print(f"--- {what}:")
+        for address, s in sorted(i2c.stats().items()):
+            print(
+                f"    {address:#04x}: {s['transactions']} transactions,"
+                f" {s['nbytes'] / seconds:.0f} bytes/s,"
+                f" {s['duration'] / seconds / 1e7:.2f}% of the bus"
+            )
+        i2c.transactions.clear()
+
+    clock = Clock(i2c, 0x70, 0x71, arbiter=arbiter)
+    i2c.transactions.clear()
+    ticks = 0
+    cpu = 0
+    end = time.time() + args.seconds
+    while time.time() < end:
+        start = time.perf_counter_ns()
+        clock.tick()
+        clock.render_ahead()
+        cpu += time.perf_counter_ns() - start
+        ticks += 1
+        time.sleep(max(0, (1/60) - (time.time() % (1/60))))
+    print(f"=== clock reads {left.text(ClockConfig.BITS)}{right.text(ClockConfig.BITS)}")
+    print(f"    {ticks} ticks, {cpu / ticks / 1e3:.1f}\xB5s each")
+    print(f"    latency: {clock.latency}")
+    report("clock", args.seconds)
+
+    fonts = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts')
+    oled = OLED((128, 64), i2c, 0x3d, arbiter=arbiter)
+    count = 20
+    start = time.perf_counter_ns()
+    async def write():
+        for n in range(count):
+            await oled.write('bottom', os.path.join(fonts, 'ProFontmedium-17.pil'), (
+                f"{n:+.3f}\xB5s",
+            ))
+    asyncio.run(write())
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    print(f"=== {count} OLED frames, {elapsed / count * 1e3:.1f}ms each")
+    report("OLED", elapsed)
+    print(f"    {sum(map(bool, big.framebuffer()))} non-blank bytes on the big OLED")
+    if arbiter is not None:
+        print(f"    arbiter: {arbiter}")
+
+    led = LED('red', 'green', pin_class=gpio.DigitalInOut)
+    for color in ('red', 'green', 'amber', 'off'):
+        getattr(led, color)()
+    print(f"=== LED: {len(gpio.transactions)} pin changes, ending {gpio.values}")
+
+
+if __name__ == '__main__':
+    main()
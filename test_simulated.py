@@ -0,0 +1,83 @@
+import asyncio, time
+
+from clock import Clock, ClockMode, Config
+from oled import OLED
+from simulated import SimI2C, SimHT16K33, SimSSD1306
+
+# The clock and an OLED, driven against the simulated bus, checking what
+# actually got written to the (simulated) chips.
+#
+#   python -m pytest test_simulated.py
+
+
+# 12:34:56 UTC, on some day or other
+NOON_ISH = (12 * 60 + 34) * 60 + 56
+
+
+def _clock(monkeypatch, ns):
+    i2c = SimI2C()
+    left = i2c.attach(SimHT16K33(0x70))
+    right = i2c.attach(SimHT16K33(0x71))
+    clock = Clock(i2c, 0x70, 0x71, local=False, blink=False, mode=ClockMode.THIRDS)
+    now = [ns]
+    monkeypatch.setattr(time, 'time_ns', lambda: now[0])
+    return i2c, left, right, clock, now
+
+
+def test_clock_tick(monkeypatch):
+    # half a second in: the thirds show 30
+    ns = (NOON_ISH * 60 + 30) * 1_000_000_000 // 60
+    i2c, left, right, clock, now = _clock(monkeypatch, ns)
+    clock.tick()
+
+    bits = Config.BITS
+    assert bytes(left.ram[:9]) == bytes((
+        bits[1], 0, bits[2], 0, Config.COLON, 0, bits[3], 0, bits[4] | Config.DOT,
+    ))
+    assert bytes(right.ram[:9]) == bytes((
+        bits[5], 0, bits[6] | Config.DOT, 0, 0, 0, bits[3], 0, bits[0],
+    ))
+    assert left.text(bits) == "12:34."
+    assert right.text(bits) == "56.30"
+
+
+def test_clock_tick_sends_only_changes(monkeypatch):
+    ns = (NOON_ISH * 60 + 30) * 1_000_000_000 // 60
+    i2c, left, right, clock, now = _clock(monkeypatch, ns)
+    clock.tick()
+
+    # the same frame again: nothing to send
+    sent = len(i2c.transactions)
+    clock.tick()
+    assert len(i2c.transactions) == sent
+
+    # the next frame: just the last digit, on the right-hand chip
+    now[0] = (NOON_ISH * 60 + 31) * 1_000_000_000 // 60
+    clock.tick()
+    assert len(i2c.transactions) == sent + 1
+    transaction = i2c.transactions[-1]
+    assert transaction.address == 0x71
+    assert transaction.nbytes == 2  # RAM address, then the one byte
+    assert right.text(Config.BITS) == "56.31"
+
+
+def test_oled_show_frame():
+    i2c = SimI2C()
+    device = i2c.attach(SimSSD1306(0x3c, (128, 32)))
+    oled = OLED((128, 32), i2c, 0x3c)
+    frame = bytes(range(256)) * 2
+
+    async def show():
+        await oled.show_frame(frame)
+        assert device.framebuffer() == frame
+
+        # change one column of one page: only that byte goes out
+        changed = bytearray(frame)
+        changed[2 * 128 + 5] ^= 0xFF
+        sent = len(i2c.transactions)
+        await oled.show_frame(bytes(changed))
+        assert device.framebuffer() == changed
+        # (the addressing commands, then the data)
+        assert [t.nbytes for t in list(i2c.transactions)[sent:]] == [7, 2]
+
+    asyncio.run(show())
@@ -0,0 +1,170 @@
+import asyncio, ctypes, errno, os, time
+
+# Absolute, wall-clock timers for asyncio, courtesy of timerfd_create(2).
+#
+# The event loop's own timers run on the monotonic clock, so to wake up
+# at a given time.time() we have to turn it into a relative delay. If
+# chrony steps the clock while we're asleep, that delay is now wrong, and
+# we wake up at the wrong time (possibly by seconds). A CLOCK_REALTIME
+# timerfd with TFD_TIMER_ABSTIME fires at the wall-clock time we asked
+# for, whatever happens to the clock in the meantime; and with
+# TFD_TIMER_CANCEL_ON_SET, the kernel tells us when the clock was stepped,
+# so that we can reschedule everything right away.
+
+CLOCK_REALTIME = 0
+TFD_NONBLOCK = os.O_NONBLOCK
+TFD_CLOEXEC = os.O_CLOEXEC
+TFD_TIMER_ABSTIME = 1 << 0
+TFD_TIMER_CANCEL_ON_SET = 1 << 1
+
+
+class timespec(ctypes.Structure):
+    _fields_ = [
+        ('tv_sec', ctypes.c_long),
+        ('tv_nsec', ctypes.c_long),
+    ]
+
+
+class itimerspec(ctypes.Structure):
+    _fields_ = [
+        ('it_interval', timespec),
+        ('it_value', timespec),
+    ]
+
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def _check(result):
+    if result < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return result
+
+
+class TimerFD:
+    r"""One absolute wall-clock timer, driven by the event loop.
+
+    Only one deadline is armed at a time (which is all the scheduler
+    needs); arming another replaces it.
+
+    :param on_step: called whenever the wall clock is stepped
+    """
+    def __init__(self, on_step=None):
+        self.on_step = on_step
+        self.steps = 0
+        self.fd = _check(_libc.timerfd_create(CLOCK_REALTIME, TFD_NONBLOCK | TFD_CLOEXEC))
+        self.loop = None
+        self.callback = None
+        self._spec = itimerspec()
+
+    def _settime(self, when, flags):
+        spec = self._spec
+        seconds, fraction = divmod(when, 1)
+        spec.it_value.tv_sec = int(seconds)
+        spec.it_value.tv_nsec = int(fraction * 1e9)
+        _check(_libc.timerfd_settime(self.fd, flags, ctypes.byref(spec), None))
+
+    def call_at(self, when, callback):
+        r"""Call something at a wall-clock time.
+
+        :param when: a time in seconds, as from time.time()
+        :param callback: called with no arguments
+        :return: a handle, whose cancel() disarms the timer
+        """
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.loop.add_reader(self.fd, self._ready)
+
+        # zero would disarm the timer, so for anything already past,
+        #  make it as close to the epoch as we can
+        when = max(when, 1e-9)
+        self._settime(when, TFD_TIMER_ABSTIME | TFD_TIMER_CANCEL_ON_SET)
+        self.callback = callback
+        return _Handle(self, callback)
+
+    def _cancel(self, callback):
+        if self.callback is not callback:
+            # it's already been replaced
+            return
+        self.callback = None
+        self._settime(0, 0)
+
+    def _ready(self):
+        try:
+            os.read(self.fd, 8)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            if e.errno != errno.ECANCELED:
+                raise
+            self.steps += 1
+            # the deadline is still good (it's absolute), but it has to be
+            #  armed again
+            _check(_libc.timerfd_settime(
+                self.fd, TFD_TIMER_ABSTIME | TFD_TIMER_CANCEL_ON_SET,
+                ctypes.byref(self._spec), None
+            ))
+            if self.on_step is not None:
+                self.on_step()
+            return
+
+        callback, self.callback = self.callback, None
+        if callback is not None:
+            callback()
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.fd)
+            self.loop = None
+        os.close(self.fd)
+
+
+class _Handle:
+    def __init__(self, timer, callback):
+        self.timer = timer
+        self.callback = callback
+
+    def cancel(self):
+        self.timer._cancel(self.callback)
+
+
+class LoopTimer:
+    r"""Wall-clock deadlines by way of the event loop's own timers.
+
+    Which is to say, turned into relative delays, and so fooled by the
+    clock being stepped. For when there's no timerfd to be had.
+    """
+    on_step = None
+    steps = 0
+
+    def call_at(self, when, callback):
+        loop = asyncio.get_running_loop()
+        return loop.call_later(when - time.time(), callback)
+
+    def close(self):
+        pass
+
+
+def realtime_timer(on_step=None):
+    r"""A TimerFD if we can get one, and a LoopTimer if not."""
+    try:
+        return TimerFD(on_step)
+    except (OSError, AttributeError):
+        timer = LoopTimer()
+        timer.on_step = on_step
+        return timer
+
+
+if __name__ == '__main__':
+    async def main():
+        timer = realtime_timer(lambda: print("the clock was stepped!"))
+        print(f"using {type(timer).__name__}")
+        for _ in range(10):
+            when = (time.time() // 1) + 1
+            fired = asyncio.get_running_loop().create_future()
+            timer.call_at(when, lambda: fired.set_result(time.time()))
+            print(f"late by {(await fired - when) * 1e6:.0f}\xB5s")
+        timer.close()
+
+    asyncio.run(main())